@@ -7,18 +7,50 @@ Created on Mon Sep 29 12:54:41 2025
 
 # -*- coding: utf-8 -*-
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
-from typing import Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
 import pandas as pd
 import io
+import os
 import traceback
 
-from audit.evaluator import evaluate_dataframe
+from audit.evaluator import evaluate_dataframe, evaluate_horizons
 from audit.summary import compute_summary
-from validators import validate_schema, infer_pair_from_df_or_filename
-from ingest.rate_fetcher import fetch_actual_rate  # implement as discussed
+from audit.cube import build_cube, cube_records, rolling_from_cube
+from audit.parallel import audit_partitioned, default_workers, shutdown_pool, PARALLEL_MIN_ROWS
+from audit.serialize import dumps, frame_payload, frame_records, PREVIEW_FORMATS
+from audit.sensitivity import sweep_actual_rates, DEFAULT_SWEEP_PCT, DEFAULT_SWEEP_STEPS
+from validators import validate_schema, validate_rows, infer_pair_from_df_or_filename, parse_row_pairs, unique_pairs
+from ingest.rate_fetcher import fetch_rate_with_age, fetch_rates_with_age, yesterday_eod, quota_metrics  # implement as discussed
+from ingest.rate_archive import RateArchive, ARCHIVE_PATH
+from ingest.rate_scheduler import RateScheduler, parse_pair_list, PREWARM_PAIRS
 
-app = FastAPI(title="Hedge Audit Service")
+scheduler = RateScheduler(parse_pair_list(PREWARM_PAIRS))
+# responses at least this large are gzip-encoded for clients sending Accept-Encoding: gzip (0 disables)
+GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", "1024"))
+
+
+class AuditJSONResponse(JSONResponse):
+    """JSON via audit.serialize.dumps: NaN/NA/NaT as null, numpy and Timestamp values without pre-cleaning."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm the rate cache and keep it warm (plus 23:59 UTC snapshots) for RATE_PREWARM_PAIRS
+    scheduler.start()
+    yield
+    scheduler.stop()
+    shutdown_pool()
+
+
+app = FastAPI(title="Hedge Audit Service", lifespan=lifespan, default_response_class=AuditJSONResponse)
+if GZIP_MIN_BYTES > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES)
 
 def _read_csv_bytes(contents: bytes) -> pd.DataFrame:
     try:
@@ -26,23 +58,8 @@ def _read_csv_bytes(contents: bytes) -> pd.DataFrame:
     except Exception as e:
         raise ValueError(f"Failed to parse CSV: {e}")
 
-@app.post("/audit")
-async def audit_csv(
-    file: UploadFile = File(...),
-    actual_rate: Optional[float] = Form(None),
-    base: Optional[str] = Form(None),
-    quote: Optional[str] = Form(None),
-    as_of_yesterday: Optional[bool] = Form(False),
-):
-    """
-    Upload a hedge log CSV and return an audit summary and a preview of the audited rows.
-
-    You can either:
-      - provide actual_rate directly, or
-      - provide base+quote (e.g., NZD, USD) so the service fetches the rate, or
-      - omit both and allow pair inference from the file (if a Pair column or filename pattern exists).
-    """
-    contents = await file.read()
+def _clean_frame(contents: bytes, filename: Optional[str] = None):
+    """Parse and validate an uploaded CSV; returns (clean frame, RowValidation)."""
     try:
         df = _read_csv_bytes(contents)
     except ValueError as e:
@@ -53,41 +70,243 @@ async def audit_csv(
     if not ok:
         raise HTTPException(status_code=400, detail=f"Missing required columns: {missing}")
 
-    # Determine actual_rate
+    # Row validation: rejected rows are excluded from the audit and reported in meta
+    validation = validate_rows(df, filename=filename)
+    if validation.clean.empty:
+        raise HTTPException(status_code=400, detail=f"No valid rows; rejected by reason: {validation.counts}")
+    return validation.clean, validation
+
+
+def _resolve_rate(df: pd.DataFrame, filename: Optional[str], actual_rate: Optional[float], base: Optional[str],
+                  quote: Optional[str], as_of_yesterday: bool, use_archive: bool, archive_horizon: Optional[str],
+                  max_staleness_seconds: Optional[float]):
+    """Actual rate(s) for an upload; returns (rate or per-row Series, rates_used, rate_age)."""
     rate = actual_rate
-    if rate is None:
+    rates_used = None
+    rate_age = None
+    row_pairs = parse_row_pairs(df) if rate is None and not (base and quote) else None
+    file_pairs = unique_pairs(row_pairs) if row_pairs is not None else []
+    if rate is None and use_archive:
+        as_of = yesterday_eod() if as_of_yesterday else None
+        try:
+            rate = RateArchive().rates_for_frame(df, as_of=as_of, horizon=archive_horizon, filename=filename)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive_horizon {archive_horizon!r}: {e}")
+        if rate.isna().all():
+            raise HTTPException(status_code=404, detail="Rate archive has no rates for this file's pairs.")
+    elif len(file_pairs) > 1:
+        # mixed-pair file: one concurrent fetch per distinct pair, then a per-row rate
+        fetched = fetch_rates_with_age(file_pairs, as_of_yesterday=as_of_yesterday, max_staleness=max_staleness_seconds)
+        failed = [f"{b}/{q}" for (b, q), (r, _age) in fetched.items() if r is None]
+        if failed:
+            raise HTTPException(status_code=502, detail=f"Failed to fetch rates for pairs: {failed}")
+        rates_used = {f"{b}/{q}": r for (b, q), (r, _age) in fetched.items()}
+        rate_age = {f"{b}/{q}": age for (b, q), (_r, age) in fetched.items()}
+        rate = row_pairs.map(rates_used)
+        if "Pair" not in df.columns:
+            df["Pair"] = row_pairs
+    elif rate is None:
         # priority: explicit base+quote -> infer from file -> fail
         pair: Optional[Tuple[str, str]] = None
         if base and quote:
             pair = (base.upper().strip(), quote.upper().strip())
         else:
-            pair = infer_pair_from_df_or_filename(df, file.filename)
+            try:
+                pair = infer_pair_from_df_or_filename(df, filename)
+            except RuntimeError:
+                pair = None
 
         if pair is None:
             raise HTTPException(status_code=400, detail="No actual_rate supplied and unable to infer currency pair; provide actual_rate or base+quote.")
         try:
             # as_of handling to avoid midnight ambiguity can be implemented inside fetch_actual_rate
-            rate = fetch_actual_rate(pair[0], pair[1], as_of_yesterday=as_of_yesterday)
+            rate, rate_age = fetch_rate_with_age(pair[0], pair[1], as_of_yesterday=as_of_yesterday,
+                                                 max_staleness=max_staleness_seconds)
         except Exception as e:
             # return helpful error instead of raw stack trace
             raise HTTPException(status_code=502, detail=f"Failed to fetch rate for pair {pair}: {e}")
 
+    return rate, rates_used, rate_age
+
+
+def _rejected_meta(validation) -> Dict:
+    return {
+        "rows": len(validation.rejected),
+        "by_reason": validation.counts,
+        "row_indices": validation.rejected.index[:100].tolist(),
+    }
+
+
+# plain def endpoints: FastAPI runs them on its threadpool, so rate fetches queued behind the
+# provider quota and the audit itself never block the event loop
+@app.post("/audit")
+def audit_csv(
+    file: UploadFile = File(...),
+    actual_rate: Optional[float] = Form(None),
+    base: Optional[str] = Form(None),
+    quote: Optional[str] = Form(None),
+    as_of_yesterday: Optional[bool] = Form(False),
+    rolling_window: Optional[str] = Form(None),
+    use_archive: Optional[bool] = Form(False),
+    archive_horizon: Optional[str] = Form(None),
+    include_sketch: Optional[bool] = Form(False),
+    max_staleness_seconds: Optional[float] = Form(None),
+    backtest_horizons: Optional[str] = Form(None),
+    include_cube: Optional[bool] = Form(False),
+    workers: Optional[int] = Form(None),
+    preview_format: str = Form("records"),
+):
+    """
+    Upload a hedge log CSV and return an audit summary and a preview of the audited rows.
+
+    You can either:
+      - provide actual_rate directly, or
+      - provide base+quote (e.g., NZD, USD) so the service fetches the rate, or
+      - omit both and allow pair inference from the file (if a Pair column or filename pattern exists).
+
+    Pass use_archive to resolve rates offline from the local rate archive (RATE_ARCHIVE_PATH);
+    with archive_horizon (e.g. 1D) each row uses the archived rate at its Timestamp + horizon.
+
+    Pass backtest_horizons (e.g. 1D,7D,30D) to also judge every row against the archived rate at
+    each forward horizon; summary.horizons (and by_pair.*.horizons) hold the horizon x metric matrix.
+
+    Uploads of AUDIT_PARALLEL_MIN_ROWS rows or more are evaluated on all cores (shared-memory row
+    partitions on one process pool shared by all requests); workers overrides the process count,
+    capped at the core count (1 keeps the audit in-process).
+
+    Pass include_cube to get the (Pair, Decision, Day) aggregation cube (additive measures that
+    audit.cube slices, rolls up and merges without the rows).
+
+    preview_format "columns" returns the preview as {"columns": [...], "data": {column: [values]}}
+    instead of one record per row (smaller and faster to encode for wide frames).
+
+    Pass rolling_window (e.g. 7D, 30D) to also get time-based rolling metrics per pair, one record
+    per pair and day (the window ending on that day).
+    Pass include_sketch to get serialised, mergeable error-distribution sketches in the summary.
+    Pass max_staleness_seconds to accept a cached rate up to that age (refreshed in the background);
+    the age of the rate actually used is returned in meta.rate_age_seconds.
+    """
+    if preview_format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"preview_format must be one of {list(PREVIEW_FORMATS)}")
+    contents = file.file.read()
+    df, validation = _clean_frame(contents, file.filename)
+    rate, rates_used, rate_age = _resolve_rate(df, file.filename, actual_rate, base, quote, as_of_yesterday,
+                                               use_archive, archive_horizon, max_staleness_seconds)
+
     # Evaluate
+    if backtest_horizons:
+        horizons = [h.strip() for h in backtest_horizons.split(",") if h.strip()]
+        try:
+            pd.to_timedelta(horizons)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid backtest_horizons {backtest_horizons!r}: {e}")
+    default_pair = None
+    if backtest_horizons:
+        try:
+            default_pair = "/".join(infer_pair_from_df_or_filename(pd.DataFrame(), file.filename))
+        except RuntimeError:
+            default_pair = None
+        keys = parse_row_pairs(df)
+        if default_pair:
+            keys = keys.fillna(default_pair)
+        archived = {f"{b}/{q}" for b, q in RateArchive().pairs()}
+        if not set(keys.dropna().unique()) & archived:
+            raise HTTPException(status_code=404, detail="Rate archive has no history for this file's pairs; cannot backtest horizons.")
+    # never more processes than cores: the shared pool is sized to default_workers()
+    if workers is None:
+        workers = default_workers() if len(df) >= PARALLEL_MIN_ROWS else 1
+    workers = min(workers, default_workers())
     try:
-        audited = evaluate_dataframe(df, actual_rate=rate, fill_missing_only=True)
-        summary = compute_summary(audited, by_pair=True)
+        if workers > 1:
+            audited, summary = audit_partitioned(df, rate, workers=workers, rate_archive=ARCHIVE_PATH if backtest_horizons else None,
+                                                 horizons=horizons if backtest_horizons else (), default_pair=default_pair,
+                                                 include_sketch=include_sketch)
+        else:
+            audited = evaluate_dataframe(df, actual_rate=rate, fill_missing_only=True)
+            if backtest_horizons:
+                audited = evaluate_horizons(audited, RateArchive().histories(), horizons, default_pair=default_pair)
+            summary = compute_summary(audited, by_pair=True, include_sketch=include_sketch)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Audit evaluation failed: {e}")
 
-    preview = audited.head(50).to_dict(orient="records")
+    cube = build_cube(audited) if rolling_window or include_cube else None
+    rolling = None
+    if rolling_window:
+        # one record per pair and day (from the cube), not one per evaluated row
+        try:
+            rolling_df = rolling_from_cube(cube, window=rolling_window)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid rolling_window {rolling_window!r}: {e}")
+        rolling = frame_records(rolling_df)
+
+    preview = frame_payload(audited.head(50), preview_format)
     # Return summary, preview, and some metadata
     response = {
         "summary": summary,
         "preview": preview,
         "meta": {
             "rows": len(audited),
-            "rate_used": rate,
+            "rate_used": rate if isinstance(rate, float) else None,
+            "rates_used": rates_used,
+            "rate_age_seconds": rate_age,
+            "rejected": _rejected_meta(validation),
         }
     }
-    return JSONResponse(content=response)
+    if rolling is not None:
+        response["rolling"] = rolling
+    if include_cube:
+        response["cube"] = cube_records(cube)
+    return AuditJSONResponse(content=response)
+
+
+@app.post("/audit/sweep")
+def audit_sweep(
+    file: UploadFile = File(...),
+    actual_rate: Optional[float] = Form(None),
+    base: Optional[str] = Form(None),
+    quote: Optional[str] = Form(None),
+    as_of_yesterday: Optional[bool] = Form(False),
+    use_archive: Optional[bool] = Form(False),
+    archive_horizon: Optional[str] = Form(None),
+    max_staleness_seconds: Optional[float] = Form(None),
+    sweep_pct: float = Form(DEFAULT_SWEEP_PCT),
+    steps: int = Form(DEFAULT_SWEEP_STEPS),
+):
+    """
+    What-if sensitivity: audit metrics for `steps` candidate actual rates spread evenly over
+    +/- sweep_pct percent around the resolved rate (same rate options as /audit).
+    Returns the curve as records: outcome counts, percent_profitable, mean_error, rmse and
+    directional_accuracy per candidate.
+    """
+    contents = file.file.read()
+    df, validation = _clean_frame(contents, file.filename)
+    rate, rates_used, rate_age = _resolve_rate(df, file.filename, actual_rate, base, quote, as_of_yesterday,
+                                               use_archive, archive_horizon, max_staleness_seconds)
+    try:
+        curve = sweep_actual_rates(df, rate, pct=sweep_pct, steps=steps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid sweep: {e}")
+
+    return AuditJSONResponse(content={
+        "curve": frame_records(curve),
+        "meta": {
+            "rows": len(df),
+            "rate_used": rate if isinstance(rate, float) else None,
+            "rates_used": rates_used,
+            "rate_age_seconds": rate_age,
+            "rejected": _rejected_meta(validation),
+        },
+    })
+
+
+@app.get("/rates/scheduler")
+def scheduler_status():
+    """Pre-warm / end-of-day snapshot scheduler status."""
+    return scheduler.status()
+
+
+@app.get("/rates/quota")
+def rate_quota():
+    """Provider quota usage: upstream calls, coalesced calls, throttling and queue depth."""
+    return quota_metrics()
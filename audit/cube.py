@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated audit cube.
+
+build_cube reduces an audited frame to one row per (Pair, Decision, Day) holding additive
+measures: counts, error sums and sums of squares, direction counts, outcome counts and
+notional, exposure and P&L sums, plus the cell's first and last timestamp. Every ratio
+(accuracy, mean error, RMSE, % profitable, value-weighted accuracy) and the per-currency
+P&L and exposure are derived from those sums, so any slice, roll-up or rolling window is
+answered from the cube without touching row-level data, and cubes from chunks or files
+merge by adding their measures (and taking min / max of the timestamps, merge_cubes).
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from audit.summary import (DEFAULT_ROUND, DEFAULT_ROLLING_WINDOW, NOTIONAL_MEASURES, ROLLING_COLUMNS,
+                           _book_metrics, _notional_metrics, notional_columns)
+from audit.timestamps import parse_timestamps
+
+CUBE_KEYS = ["Pair", "Decision", "Day"]
+OUTCOME_MEASURES = {
+    "Profitable": "profitable",
+    "Missed": "missed",
+    "Good Wait": "good_wait",
+    "Should've Hedged": "should_have_hedged",
+    "Unknown": "unknown_outcome",
+}
+CUBE_MEASURES = [
+    "rows", "evaluated", "err_n", "err_sum", "err_sq", "dir_n", "dir_sum",
+    *OUTCOME_MEASURES.values(), *NOTIONAL_MEASURES,
+]
+# true first / last timestamp per cell (Day alone is floored), merged by min / max instead of sum
+CUBE_BOUNDS = {"first_ts": "min", "last_ts": "max"}
+
+
+def _aggregate(parts: pd.DataFrame) -> pd.DataFrame:
+    aggs = {**{m: "sum" for m in CUBE_MEASURES}, **CUBE_BOUNDS}
+    return parts.groupby(CUBE_KEYS, dropna=False, sort=True).agg(aggs).reset_index()
+
+
+def build_cube(df: pd.DataFrame, ts_col: str = "Timestamp") -> pd.DataFrame:
+    """Aggregate an audited frame (evaluate_dataframe output) into the (Pair, Decision, Day) cube."""
+    idx = df.index
+    missing = pd.Series(np.nan, index=idx)
+    ts = parse_timestamps(df[ts_col]) if ts_col in df.columns else pd.Series(pd.NaT, index=idx, dtype="datetime64[ns]")
+    error = pd.to_numeric(df["Error"], errors="coerce") if "Error" in df.columns else missing
+    correct = pd.to_numeric(df["CorrectDirection"], errors="coerce") if "CorrectDirection" in df.columns else missing
+    outcome = df["HedgeOutcome"] if "HedgeOutcome" in df.columns else missing
+
+    parts = pd.DataFrame({
+        "Pair": (df["Pair"] if "Pair" in df.columns else missing).fillna("UNKNOWN").astype(str),
+        "Decision": (df["Decision"] if "Decision" in df.columns else missing).fillna("").astype(str).str.strip(),
+        "Day": ts.dt.floor("D"),
+        "rows": 1,
+        "evaluated": (df["Actual"].notna() if "Actual" in df.columns else missing.notna()).astype(int),
+        "err_n": error.notna().astype(int),
+        "err_sum": error.fillna(0.0),
+        "err_sq": (error ** 2).fillna(0.0),
+        "dir_n": correct.notna().astype(int),
+        "dir_sum": correct.fillna(0.0),
+        **{col: (outcome == label).astype(int) for label, col in OUTCOME_MEASURES.items()},
+        **notional_columns(df),
+        "first_ts": ts,
+        "last_ts": ts,
+    })
+    return _aggregate(parts)
+
+
+def merge_cubes(cubes: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Combine cubes from chunks, partitions or files."""
+    return _aggregate(pd.concat(list(cubes), ignore_index=True))
+
+
+def slice_cube(cube: pd.DataFrame, pairs: Optional[Sequence[str]] = None, decisions: Optional[Sequence[str]] = None,
+               start=None, end=None) -> pd.DataFrame:
+    """Cells for the given pairs / decisions and day range (inclusive); None keeps everything."""
+    keep = pd.Series(True, index=cube.index)
+    if pairs is not None:
+        keep &= cube["Pair"].isin(pairs)
+    if decisions is not None:
+        keep &= cube["Decision"].isin(decisions)
+    if start is not None:
+        keep &= cube["Day"] >= pd.Timestamp(start)
+    if end is not None:
+        keep &= cube["Day"] <= pd.Timestamp(end)
+    return cube[keep]
+
+
+def _ratios(sums: pd.DataFrame, round_digits: int) -> pd.DataFrame:
+    """Metrics from summed measures (one row per group)."""
+    err_n = sums["err_n"].where(sums["err_n"] > 0)
+    dir_n = sums["dir_n"].where(sums["dir_n"] > 0)
+    evaluated = sums["evaluated"].where(sums["evaluated"] > 0)
+    notional_dir = sums["notional_dir"].where(sums["notional_dir"] > 0)
+    return pd.DataFrame({
+        "rows": sums["rows"].astype(int),
+        "rows_evaluated": sums["evaluated"].astype(int),
+        "directional_accuracy": (sums["dir_sum"] / dir_n).round(round_digits),
+        "mean_error": (sums["err_sum"] / err_n).round(round_digits),
+        "rmse": ((sums["err_sq"] / err_n) ** 0.5).round(round_digits),
+        "percent_profitable": (sums["profitable"] / evaluated * 100).round(4),
+        "value_weighted_accuracy": (sums["notional_correct"] / notional_dir).round(round_digits),
+    }, index=sums.index)
+
+
+def cube_breakdown(cube: pd.DataFrame, by: Sequence[str] = ("Pair",), freq: Optional[str] = None,
+                   round_digits: int = DEFAULT_ROUND) -> pd.DataFrame:
+    """Metrics per group of cube keys; freq (e.g. "W") re-buckets Day before grouping."""
+    cells = cube
+    if freq is not None and "Day" in by:
+        cells = cube.assign(Day=cube["Day"].dt.to_period(freq).dt.start_time)
+    sums = cells.groupby(list(by), dropna=False, sort=True)[CUBE_MEASURES].sum()
+    return _ratios(sums, round_digits).reset_index()
+
+
+def summary_from_cube(cube: pd.DataFrame, round_digits: int = DEFAULT_ROUND, by_pair: bool = False) -> Dict:
+    """
+    compute_summary's headline metrics, value-weighted accuracy and (when the log carried notionals)
+    per-currency P&L and exposure, answered from the cube.
+    """
+    summary = _headline_from_cube(cube, round_digits)
+    # the cube holds zero notionals for logs without a Notional column
+    notional = cube.groupby("Pair")[NOTIONAL_MEASURES].sum() if cube["notional"].any() else None
+    if notional is not None:
+        summary.update(_book_metrics(notional, round_digits))
+    if by_pair:
+        pair_grp = {}
+        for pair, cells in cube.groupby("Pair"):
+            pair_summary = _headline_from_cube(cells, round_digits)
+            if notional is not None:
+                pair_summary.update(_notional_metrics(notional.loc[pair], round_digits))
+            pair_grp[str(pair)] = pair_summary
+        summary["by_pair"] = pair_grp
+    return summary
+
+
+def _headline_from_cube(cube: pd.DataFrame, round_digits: int) -> Dict:
+    totals = cube[CUBE_MEASURES].sum()
+    total = int(totals["rows"])
+    evaluated = int(totals["evaluated"])
+    ratios = _ratios(totals.to_frame().T, round_digits).iloc[0]
+    first, last = cube["first_ts"].min(), cube["last_ts"].max()
+
+    def _val(x):
+        return None if pd.isna(x) else float(x)
+
+    return {
+        "total_rows": total,
+        "rows_evaluated": evaluated,
+        "percent_missing_actuals": round(((total - evaluated) / total) * 100, 4) if total else None,
+        "mean_error": _val(ratios["mean_error"]),
+        "rmse": _val(ratios["rmse"]),
+        "directional_accuracy": _val(ratios["directional_accuracy"]),
+        "profitable_hedges": int(totals["profitable"]),
+        "missed_hedges": int(totals["should_have_hedged"]),
+        "percent_profitable": round(int(totals["profitable"]) / evaluated * 100, 4) if evaluated else None,
+        "value_weighted_accuracy": _val(ratios["value_weighted_accuracy"]),
+        "date_range": {"min": first.isoformat(), "max": last.isoformat()} if pd.notna(first) else None,
+    }
+
+
+def rolling_from_cube(cube: pd.DataFrame, window: str = DEFAULT_ROLLING_WINDOW,
+                      round_digits: int = DEFAULT_ROUND) -> pd.DataFrame:
+    """
+    Daily time-based rolling metrics per pair (ROLLING_COLUMNS, Timestamp = day), from the cube.
+    Only evaluated rows count. This is the one rolling implementation shared by the CLI, API and dashboard.
+    """
+    cells = cube[cube["Day"].notna() & (cube["evaluated"] > 0)]
+    if cells.empty:
+        return pd.DataFrame(columns=ROLLING_COLUMNS)
+    daily = cells.groupby(["Pair", "Day"], sort=True)[CUBE_MEASURES].sum().reset_index()
+    sums = (
+        daily.groupby("Pair", sort=False)
+             .rolling(window, on="Day")[CUBE_MEASURES]
+             .sum()
+             .reset_index(level=0)
+    )
+    ratios = _ratios(sums, round_digits)
+    out = pd.DataFrame({
+        "Timestamp": daily["Day"].to_numpy(),
+        "Pair": sums["Pair"].to_numpy(),
+        "rows_evaluated": ratios["rows_evaluated"].to_numpy(),
+        "directional_accuracy": ratios["directional_accuracy"].to_numpy(),
+        "mean_error": ratios["mean_error"].to_numpy(),
+        "rmse": ratios["rmse"].to_numpy(),
+        "percent_profitable": ratios["percent_profitable"].to_numpy(),
+    })
+    return out.reset_index(drop=True)
+
+
+def cube_records(cube: pd.DataFrame) -> List[Dict]:
+    """JSON-friendly records (Day as ISO date)."""
+    out = cube.assign(Day=cube["Day"].map(lambda d: d.date().isoformat() if pd.notna(d) else None),
+                      **{col: cube[col].map(lambda t: t.isoformat() if pd.notna(t) else None) for col in CUBE_BOUNDS})
+    return out.astype(object).where(out.notna(), None).to_dict(orient="records")
@@ -6,18 +6,34 @@ Created on Mon Sep 29 12:44:56 2025
 """
 import pandas as pd
 import numpy as np
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Mapping, Sequence, Tuple, Union
+
+from audit.timestamps import to_utc_ns, NAT_NS
+from validators import parse_row_pairs, MODEL_PREFIX
 
 REQUIRED_COLUMNS = ["Timestamp", "Predicted_Rate", "Live_Rate", "Decision"]
+DEFAULT_HORIZONS = ("1D", "7D", "30D")
+# a horizon's rate must be at most this much older than Timestamp + h (covers weekends and holidays)
+DEFAULT_HORIZON_TOLERANCE = "4D"
+HORIZON_PREFIX = "T+"
 
 def normalize_df(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+    """
+    Shallow copy with normalised column names and the audit columns present.
+    Column data is shared with the input, so later stages must replace whole columns
+    (df[col] = ...) rather than write into them.
+    """
+    df = df.copy(deep=False)
     df.columns = df.columns.str.strip().str.replace(" ", "_")
-    for col in ["Actual", "Error", "CorrectDirection", "HedgeOutcome", "Pair"]:
+    for col in ["Predicted_Rate", "Actual", "Error", "CorrectDirection", "HedgeOutcome", "Pair"]:
         if col not in df.columns:
             df[col] = np.nan
     return df
 
+def prediction_models(df: pd.DataFrame) -> List[str]:
+    """Model names of the Predicted_Rate_<model> columns in df, in column order."""
+    return [str(c)[len(MODEL_PREFIX):] for c in df.columns if str(c).startswith(MODEL_PREFIX)]
+
 def evaluate_row(row: pd.Series, actual_rate: Optional[float]) -> pd.Series:
     out = row.copy()
     if pd.isna(out.get("Predicted_Rate")) or pd.isna(out.get("Live_Rate")) or actual_rate is None:
@@ -40,18 +56,169 @@ def evaluate_row(row: pd.Series, actual_rate: Optional[float]) -> pd.Series:
     out["HedgeOutcome"] = hedge_outcome
     return out
 
-def evaluate_dataframe(df: pd.DataFrame, actual_rate: Optional[float], fill_missing_only: bool = True) -> pd.DataFrame:
+def evaluate_dataframe(df: pd.DataFrame, actual_rate: Union[None, float, pd.Series], fill_missing_only: bool = True,
+                       models: Optional[Sequence[str]] = None) -> pd.DataFrame:
     """
     Evaluate rows in df using actual_rate.
+    - actual_rate is either one rate for every row or a Series aligned to df.index
+      (e.g. each row's own pair rate for multi-pair files); rows with a missing rate are skipped.
     - If fill_missing_only is True, only rows with Actual==NaN are evaluated.
-    - Returns a new DataFrame (does not mutate input).
+    - models: Predicted_Rate_<model> columns to evaluate side by side (None = all of them, [] = none).
+      Each model gets Error_<model>, CorrectDirection_<model> and HedgeOutcome_<model>, judged
+      against the row's Actual (or actual_rate where Actual is missing); a Decision_<model>
+      column, when present, replaces Decision for that model's outcomes.
+    - Returns a new DataFrame sharing the untouched columns with df (df itself is not mutated).
+    Same rules as evaluate_row, applied to all rows at once.
     """
     df = normalize_df(df)
-    if fill_missing_only:
-        mask = df["Actual"].isna()
+    if actual_rate is None:
+        return df
+
+    if isinstance(actual_rate, pd.Series):
+        actual = pd.to_numeric(actual_rate.reindex(df.index), errors="coerce")
     else:
-        mask = pd.Series(True, index=df.index)
+        actual = pd.Series(float(actual_rate), index=df.index)
+    pred = pd.to_numeric(df["Predicted_Rate"], errors="coerce")
+    live = pd.to_numeric(df["Live_Rate"], errors="coerce")
+
+    mask = pred.notna() & live.notna() & actual.notna()
+    if fill_missing_only:
+        mask &= df["Actual"].isna()
+    if mask.any():
+        error, correct, outcome = _evaluate_arrays(pred.to_numpy(), live.to_numpy(), actual.to_numpy(), _decisions(df))
+
+        # new columns replace the shared ones; the input frame is never written to
+        df["Actual"] = df["Actual"].mask(mask, actual)
+        df["Error"] = df["Error"].mask(mask, pd.Series(error, index=df.index))
+        df["CorrectDirection"] = df["CorrectDirection"].astype(object).mask(mask, pd.Series(correct, index=df.index, dtype=object))
+        df["HedgeOutcome"] = df["HedgeOutcome"].astype(object).mask(mask, pd.Series(outcome, index=df.index))
 
-    for idx in df[mask].index:
-        df.loc[idx] = evaluate_row(df.loc[idx], actual_rate)
+    models = prediction_models(df) if models is None else list(models)
+    if models:
+        df = _evaluate_models(df, models, pd.to_numeric(df["Actual"], errors="coerce").fillna(actual), live)
     return df
+
+def _evaluate_models(df: pd.DataFrame, models: Sequence[str], actual: pd.Series, live: pd.Series) -> pd.DataFrame:
+    """All models at once: a (rows, models) prediction matrix against one actual/live column."""
+    preds = np.column_stack([pd.to_numeric(df[MODEL_PREFIX + m], errors="coerce").to_numpy(dtype=float) for m in models])
+    shared = _decisions(df)
+    decisions = np.column_stack([
+        df[f"Decision_{m}"].astype(str).str.strip().to_numpy() if f"Decision_{m}" in df.columns else shared
+        for m in models
+    ])
+    a = actual.to_numpy(dtype=float)[:, None]
+    lv = live.to_numpy(dtype=float)[:, None]
+    error, correct, outcome = _evaluate_arrays(preds, lv, a, decisions)
+    valid = ~np.isnan(preds) & ~np.isnan(a) & ~np.isnan(lv)
+
+    new_cols = {}
+    for j, m in enumerate(models):
+        v = valid[:, j]
+        new_cols[f"Error_{m}"] = np.where(v, error[:, j], np.nan)
+        new_cols[f"CorrectDirection_{m}"] = np.where(v, correct[:, j].astype(object), np.nan)
+        new_cols[f"HedgeOutcome_{m}"] = np.where(v, outcome[:, j].astype(object), np.nan)
+    return _add_columns(df, new_cols)
+
+def _add_columns(df: pd.DataFrame, new_cols: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Add columns to a normalize_df frame in place (DataFrame.assign would deep-copy every column)."""
+    for col, values in new_cols.items():
+        df[col] = values
+    return df
+
+def _decisions(df: pd.DataFrame) -> np.ndarray:
+    if "Decision" not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    return df["Decision"].astype(str).str.strip().to_numpy()
+
+def _evaluate_arrays(pred: np.ndarray, live: np.ndarray, actual: np.ndarray, decision: np.ndarray):
+    """
+    Error, CorrectDirection and HedgeOutcome arrays (the evaluate_row rules) for aligned inputs.
+    Inputs broadcast, so a (rows, k) actual with (rows, 1) pred/live/decision evaluates k
+    actuals per row at once.
+    """
+    hedge = decision == "Hedge now"
+    wait = decision == "Wait"
+    # object choices: the result holds references to five shared strings, not a fixed-width copy per row
+    outcome = np.select(
+        [hedge & (actual < live), hedge, wait & (actual > live), wait],
+        [np.array(label, dtype=object) for label in ("Profitable", "Missed", "Good Wait", "Should've Hedged")],
+        default=np.array("Unknown", dtype=object),
+    )
+    return pred - actual, (pred > live) == (actual > live), outcome
+
+def horizon_labels(df: pd.DataFrame) -> List[str]:
+    """Horizons evaluated by evaluate_horizons, e.g. ['T+1D', 'T+7D'], from the column names."""
+    prefix = "HedgeOutcome_" + HORIZON_PREFIX
+    return [c[len("HedgeOutcome_"):] for c in df.columns if c.startswith(prefix)]
+
+def _history_index(history: Union[pd.DataFrame, Mapping[str, Tuple[np.ndarray, np.ndarray]]]) -> Mapping[str, Tuple[np.ndarray, np.ndarray]]:
+    if not isinstance(history, pd.DataFrame):
+        return history
+    keys = parse_row_pairs(history).to_numpy()
+    ts = to_utc_ns(history["Timestamp"])
+    rate = pd.to_numeric(history["Rate"], errors="coerce").to_numpy(dtype=float)
+    ok = np.flatnonzero(pd.notna(keys) & (ts != NAT_NS) & ~np.isnan(rate))
+    index = {}
+    for key, rows in pd.Series(ok).groupby(keys[ok]):
+        rows = rows.to_numpy()
+        rows = rows[np.argsort(ts[rows], kind="stable")]
+        index[key] = (ts[rows], rate[rows])
+    return index
+
+def evaluate_horizons(df: pd.DataFrame, history: Union[pd.DataFrame, Mapping[str, Tuple[np.ndarray, np.ndarray]]],
+                      horizons: Sequence[str] = DEFAULT_HORIZONS, default_pair: Optional[str] = None,
+                      ts_col: str = "Timestamp", tolerance: Optional[str] = DEFAULT_HORIZON_TOLERANCE) -> pd.DataFrame:
+    """
+    Backtest every row against the realised rate at several forward horizons.
+    - history is either a DataFrame with Timestamp, Pair (or Base/Quote) and Rate columns, or a
+      mapping 'BASE/QUOTE' -> (sorted int64 ns UTC timestamps, rates), e.g. RateArchive.histories().
+    - horizons are pandas offsets ("1D", "7D", "30D"); each row's actual at horizon h is the last
+      history point at or before Timestamp + h. Rows whose horizon lies past the end of the pair's
+      history (not realised yet), or whose nearest point is older than tolerance (a gap in the
+      archive; None accepts any age), stay NaN.
+    - default_pair ('NZD/USD') is used for rows without a parseable pair.
+    Adds Actual_T+h, Error_T+h, CorrectDirection_T+h and HedgeOutcome_T+h per horizon; the
+    existing Actual/Error columns are left alone. Returns a new DataFrame (see evaluate_dataframe).
+    """
+    df = normalize_df(df)
+    offsets = np.array([pd.Timedelta(h).value for h in horizons], dtype=np.int64)
+    max_age = pd.Timedelta(tolerance).value if tolerance is not None else None
+    labels = [f"{HORIZON_PREFIX}{h}" for h in horizons]
+    index = _history_index(history)
+
+    keys = parse_row_pairs(df)
+    if default_pair:
+        keys = keys.fillna(default_pair)
+    keys = keys.to_numpy()
+    ts = to_utc_ns(df[ts_col]) if ts_col in df.columns else np.full(len(df), NAT_NS)
+
+    # one time index per pair: rows sorted once, all horizons resolved by one searchsorted
+    actual = np.full((len(df), len(offsets)), np.nan)
+    ok = np.flatnonzero(pd.notna(keys) & (ts != NAT_NS))
+    for key, rows in pd.Series(ok).groupby(keys[ok]):
+        hist = index.get(key)
+        if hist is None or len(hist[0]) == 0:
+            continue
+        hist_ts, hist_rate = hist
+        rows = rows.to_numpy()
+        rows = rows[np.argsort(ts[rows], kind="stable")]
+        q = ts[rows][:, None] + offsets[None, :]
+        idx = np.searchsorted(hist_ts, q, side="right") - 1
+        realised = (idx >= 0) & (q <= hist_ts[-1])
+        if max_age is not None:
+            realised &= (q - np.asarray(hist_ts)[np.clip(idx, 0, None)]) <= max_age
+        actual[rows] = np.where(realised, np.asarray(hist_rate)[np.clip(idx, 0, None)], np.nan)
+
+    pred = pd.to_numeric(df["Predicted_Rate"], errors="coerce").to_numpy(dtype=float)[:, None]
+    live = pd.to_numeric(df["Live_Rate"], errors="coerce").to_numpy(dtype=float)[:, None]
+    error, correct, outcome = _evaluate_arrays(pred, live, actual, _decisions(df)[:, None])
+    valid = ~np.isnan(actual) & ~np.isnan(pred) & ~np.isnan(live)
+
+    new_cols = {}
+    for j, label in enumerate(labels):
+        v = valid[:, j]
+        new_cols[f"Actual_{label}"] = np.where(v, actual[:, j], np.nan)
+        new_cols[f"Error_{label}"] = np.where(v, error[:, j], np.nan)
+        new_cols[f"CorrectDirection_{label}"] = np.where(v, correct[:, j].astype(object), np.nan)
+        new_cols[f"HedgeOutcome_{label}"] = np.where(v, outcome[:, j].astype(object), np.nan)
+    return _add_columns(df, new_cols)
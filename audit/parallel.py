@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioned, multi-core audit of one large hedge log.
+
+audit_partitioned splits a validated frame into row partitions and runs evaluate_dataframe
+(plus evaluate_horizons when a rate archive is given) and summary_partials for each one on a
+process pool. Nothing row-sized is pickled:
+
+- the columns the audit reads are packed once into a shared-memory block (numeric and
+  datetime columns as raw buffers, everything else as int32 codes + a small table of values),
+  and every worker attaches to it at start-up;
+- workers write their evaluated columns into a second shared block (float64 values, or
+  codes into a per-partition table for object columns such as HedgeOutcome);
+- only the partial summaries and those small tables travel back, and the parent merges them
+  into the dict compute_summary returns (merge_summary_partials / summary_from_partials).
+
+All audits in a process share one pool of at most default_workers() processes, so concurrent
+audits (API requests) queue for cores instead of each starting their own pool. Workers are
+spawned rather than forked, so the pool can start from threaded hosts (the API); each task
+attaches to its audit's shared blocks and detaches when done.
+"""
+
+import gc
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+from audit.evaluator import HORIZON_PREFIX, evaluate_dataframe, evaluate_horizons, normalize_df, prediction_models
+from audit.summary import DEFAULT_ROUND, merge_summary_partials, summary_from_partials, summary_partials
+from validators import MODEL_PREFIX
+
+PARALLEL_MIN_ROWS = int(os.getenv("AUDIT_PARALLEL_MIN_ROWS", "1000000"))
+_ACTUAL_RATE_COL = "__actual_rate__"
+_ALIGN = 8
+
+# rate histories per archive path, loaded once per worker process
+_histories: Dict[str, Dict] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _shared_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=default_workers(), mp_context=get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the shared worker pool (it is started again by the next audit_partitioned call)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _audit_columns(df: pd.DataFrame, models: Sequence[str]) -> List[str]:
+    """Columns evaluate_dataframe / evaluate_horizons / summary_partials read."""
+    wanted = {"Timestamp", "Predicted_Rate", "Live_Rate", "Decision", "Actual", "Error", "CorrectDirection",
+              "HedgeOutcome", "Pair", "Base", "Quote", "Currency_Pair", "Pair_Name", "Notional"}
+    wanted |= {MODEL_PREFIX + m for m in models} | {f"Decision_{m}" for m in models}
+    return [c for c in df.columns if c in wanted or str(c).lower() in ("pair", "currency_pair", "pair_name")]
+
+
+def _output_columns(models: Sequence[str], horizons: Sequence[str]) -> List[str]:
+    cols = ["Actual", "Error", "CorrectDirection", "HedgeOutcome"]
+    for m in models:
+        cols += [f"Error_{m}", f"CorrectDirection_{m}", f"HedgeOutcome_{m}"]
+    for h in horizons:
+        label = f"{HORIZON_PREFIX}{h}"
+        cols += [f"Actual_{label}", f"Error_{label}", f"CorrectDirection_{label}", f"HedgeOutcome_{label}"]
+    return cols
+
+
+def _factorize(values: pd.Series) -> Tuple[np.ndarray, Union[np.ndarray, pd.api.extensions.ExtensionArray]]:
+    """Codes (-1 for missing) and a value table that take(..., allow_fill=True) maps back."""
+    codes, uniques = values.factorize()
+    return codes, (uniques.array if isinstance(uniques.dtype, pd.api.extensions.ExtensionDtype) else uniques.to_numpy())
+
+
+def _encode(series: pd.Series) -> Tuple[np.ndarray, Dict]:
+    """Fixed-width buffer for a column plus what is needed to rebuild it."""
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "fiub":
+        return np.ascontiguousarray(series.to_numpy()), {"dtype": dtype.str}
+    if isinstance(dtype, np.dtype) and dtype.kind == "M":
+        return series.to_numpy().view(np.int64), {"dtype": dtype.str, "datetime": True}
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        # tz-aware (e.g. UTC offsets parsed by audit.timestamps): UTC int64 plus the zone, not a uniques table
+        return series.array.asi8, {"dtype": np.dtype(f"M8[{dtype.unit}]").str, "datetime": True, "tz": str(dtype.tz)}
+    codes, uniques = _factorize(series)
+    return codes.astype(np.int32), {"dtype": np.dtype(np.int32).str, "uniques": uniques}
+
+
+def _decode(buf: np.ndarray, spec: Dict) -> Union[np.ndarray, pd.api.extensions.ExtensionArray]:
+    if "uniques" in spec:
+        return take(spec["uniques"], buf, allow_fill=True)
+    if spec.get("tz"):
+        return pd.DatetimeIndex(buf.view(spec["dtype"])).tz_localize("UTC").tz_convert(spec["tz"]).array
+    if spec.get("datetime"):
+        return buf.view(spec["dtype"])
+    return buf
+
+
+def _pack(arrays: Dict[str, np.ndarray]) -> Tuple[shared_memory.SharedMemory, Dict[str, Tuple[int, str]]]:
+    """Copy arrays into one shared block; returns it and name -> (offset, dtype)."""
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        layout[name] = (offset, arr.dtype.str)
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, _ALIGN))
+    for name, arr in arrays.items():
+        start, dtype = layout[name]
+        np.ndarray(arr.shape, dtype=dtype, buffer=shm.buf, offset=start)[:] = arr
+    return shm, layout
+
+
+def _view(shm: shared_memory.SharedMemory, start: int, dtype: str, rows: int) -> np.ndarray:
+    return np.ndarray((rows,), dtype=dtype, buffer=shm.buf, offset=start)
+
+
+def _audit_partition(job: Dict, start: int, stop: int) -> Tuple[Dict, Dict[str, Optional[np.ndarray]]]:
+    """Evaluate rows [start, stop) of job's shared blocks; returns (summary partials, object-column tables)."""
+    # spawned workers share the parent's resource tracker, so the parent's unlink releases both blocks
+    in_shm = shared_memory.SharedMemory(name=job["in_name"])
+    out_shm = shared_memory.SharedMemory(name=job["out_name"])
+    try:
+        return _evaluate_partition(in_shm, out_shm, job, start, stop)
+    finally:
+        for shm in (in_shm, out_shm):
+            try:
+                shm.close()
+            except BufferError:
+                # a frame in a reference cycle still views the block: collect it, then unmap
+                gc.collect()
+                shm.close()
+
+
+def _evaluate_partition(in_shm: shared_memory.SharedMemory, out_shm: shared_memory.SharedMemory, job: Dict,
+                        start: int, stop: int) -> Tuple[Dict, Dict[str, Optional[np.ndarray]]]:
+    task, rows = job["task"], job["rows"]
+    cols = {}
+    for name, (offset, dtype) in job["layout"].items():
+        cols[name] = _decode(_view(in_shm, offset, dtype, rows)[start:stop], job["specs"][name])
+    actual = cols.pop(_ACTUAL_RATE_COL, None)
+    part = pd.DataFrame(cols, index=pd.RangeIndex(start, stop), copy=False)
+    rate = pd.Series(actual, index=part.index) if actual is not None else task["actual_rate"]
+
+    audited = evaluate_dataframe(part, actual_rate=rate, fill_missing_only=task["fill_missing_only"],
+                                 models=task["models"])
+    if task["horizons"]:
+        if task["rate_archive"] not in _histories:
+            from ingest.rate_archive import RateArchive
+            _histories[task["rate_archive"]] = RateArchive(task["rate_archive"]).histories()
+        audited = evaluate_horizons(audited, _histories[task["rate_archive"]], task["horizons"],
+                                    default_pair=task["default_pair"])
+
+    tables = {}
+    for j, col in enumerate(job["out_cols"]):
+        out = _view(out_shm, j * rows * 8, "<f8", rows)[start:stop]
+        values = audited[col]
+        if values.dtype.kind == "f":
+            out[:] = values.to_numpy()
+            tables[col] = None
+        else:
+            codes, uniques = _factorize(values)
+            out[:] = codes
+            tables[col] = uniques
+    return summary_partials(audited), tables
+
+
+def audit_partitioned(
+    df: pd.DataFrame,
+    actual_rate: Union[None, float, pd.Series],
+    workers: Optional[int] = None,
+    partitions: Optional[int] = None,
+    fill_missing_only: bool = True,
+    models: Optional[Sequence[str]] = None,
+    rate_archive: Optional[str] = None,
+    horizons: Sequence[str] = (),
+    default_pair: Optional[str] = None,
+    round_digits: int = DEFAULT_ROUND,
+    by_pair: bool = True,
+    include_sketch: bool = False,
+) -> Tuple[pd.DataFrame, Dict]:
+    """
+    evaluate_dataframe (+ evaluate_horizons against rate_archive) and compute_summary for a large
+    frame on the shared process pool. Returns (audited frame, summary); the audited frame is what
+    the single-process path returns, the summary matches compute_summary except that
+    abs_error_quantiles come from merged sketches (same error bound).
+    - workers is capped at default_workers() (the pool's size); partitions defaults to workers and
+      rows are split into contiguous, near-equal ranges.
+    - horizons need rate_archive (a RateArchive directory each worker memory-maps itself).
+    """
+    workers = min(workers or default_workers(), default_workers())
+    partitions = max(1, min(partitions or workers, len(df)))
+    df = normalize_df(df)
+    models = prediction_models(df) if models is None else list(models)
+    if horizons and not rate_archive:
+        raise ValueError("horizons need rate_archive")
+    out_cols = _output_columns(models, horizons) if actual_rate is not None else []
+    rows = len(df)
+
+    arrays, specs = {}, {}
+    for col in _audit_columns(df, models):
+        arrays[col], specs[col] = _encode(df[col])
+    task = {"actual_rate": actual_rate, "fill_missing_only": fill_missing_only, "models": models,
+            "horizons": list(horizons), "rate_archive": rate_archive, "default_pair": default_pair}
+    if isinstance(actual_rate, pd.Series):
+        arrays[_ACTUAL_RATE_COL] = pd.to_numeric(actual_rate.reindex(df.index), errors="coerce").to_numpy(dtype=np.float64)
+        specs[_ACTUAL_RATE_COL] = {"dtype": "<f8"}
+        task["actual_rate"] = None
+
+    in_shm, layout = _pack(arrays)
+    del arrays
+    out_shm = shared_memory.SharedMemory(create=True, size=max(len(out_cols) * rows * 8, _ALIGN))
+    job = {"in_name": in_shm.name, "out_name": out_shm.name, "rows": rows, "layout": layout, "specs": specs,
+           "out_cols": out_cols, "task": task}
+    try:
+        bounds = np.linspace(0, rows, partitions + 1).astype(int)
+        try:
+            results = list(_shared_pool().map(_audit_partition, [job] * partitions, bounds[:-1], bounds[1:]))
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory): start a fresh pool for the next audit
+            shutdown_pool()
+            raise
+
+        audited = df
+        if actual_rate is not None:
+            for j, col in enumerate(out_cols):
+                values = _view(out_shm, j * rows * 8, "<f8", rows)
+                if all(tables[col] is None for _, tables in results):
+                    audited[col] = values.copy()
+                    continue
+                # object column: decode each partition's codes against its own table
+                decoded = np.empty(rows, dtype=object)
+                for (start, stop), (_, tables) in zip(zip(bounds[:-1], bounds[1:]), results):
+                    part = values[start:stop]
+                    if tables[col] is None:
+                        decoded[start:stop] = part
+                    else:
+                        decoded[start:stop] = np.asarray(take(tables[col], part.astype(np.intp), allow_fill=True), dtype=object)
+                audited[col] = decoded
+    finally:
+        for shm in (in_shm, out_shm):
+            shm.close()
+            shm.unlink()
+
+    partials = merge_summary_partials(partial for partial, _ in results)
+    summary = summary_from_partials(partials, round_digits=round_digits, by_pair=by_pair, include_sketch=include_sketch)
+    return audited, summary
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+What-if sweep of the realised rate.
+
+sweep_actual_rates answers "what would the audit say if the actual rate ended up at
+each of these candidates?" for a whole grid at once. Candidates are expressed as a
+multiplier k of each row's centre rate (k = 1 is today's rate), which turns every
+outcome rule into a threshold on the per-row ratio Live_Rate / centre:
+
+    actual < live  <=>  k < live / centre
+
+so sorting those ratios once per decision class lets np.searchsorted count outcomes and
+correct directions for every candidate together. Error statistics come from per-row
+moment sums (error = d - (k - 1) * centre, d = Predicted_Rate - centre), so the cost is
+O(rows log rows + candidates) and no rows x candidates matrix is materialised.
+
+Each point of the curve matches evaluate_dataframe + compute_summary run with that
+candidate as actual_rate.
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from audit.evaluator import normalize_df
+from audit.summary import DEFAULT_ROUND
+
+DEFAULT_SWEEP_PCT = 2.0
+DEFAULT_SWEEP_STEPS = 41
+
+SWEEP_COLUMNS = [
+    "shift_pct", "actual_rate", "rows_evaluated", "profitable", "missed", "good_wait",
+    "should_have_hedged", "unknown", "percent_profitable", "mean_error", "rmse", "directional_accuracy",
+]
+_OUTCOME_COLUMNS = {
+    "Profitable": "profitable",
+    "Missed": "missed",
+    "Good Wait": "good_wait",
+    "Should've Hedged": "should_have_hedged",
+    "Unknown": "unknown",
+}
+
+
+def rate_multipliers(pct: float = DEFAULT_SWEEP_PCT, steps: int = DEFAULT_SWEEP_STEPS) -> np.ndarray:
+    """Evenly spaced multipliers covering +/- pct percent around 1.0 (inclusive)."""
+    if pct <= 0:
+        raise ValueError("pct must be positive")
+    if steps < 2:
+        raise ValueError("steps must be at least 2")
+    return np.linspace(1.0 - pct / 100.0, 1.0 + pct / 100.0, int(steps))
+
+
+def _count_below(sorted_vals: np.ndarray, k: np.ndarray, inclusive: bool = False) -> np.ndarray:
+    """Number of sorted_vals < k (<= k when inclusive) for every candidate."""
+    return np.searchsorted(sorted_vals, k, side="right" if inclusive else "left")
+
+
+def sweep_actual_rates(df: pd.DataFrame, actual_rate: Union[float, pd.Series],
+                       pct: float = DEFAULT_SWEEP_PCT, steps: int = DEFAULT_SWEEP_STEPS,
+                       multipliers: Optional[np.ndarray] = None, fill_missing_only: bool = True,
+                       round_digits: int = DEFAULT_ROUND) -> pd.DataFrame:
+    """
+    Audit metrics for a grid of candidate actual rates around actual_rate.
+    - actual_rate is one rate or a per-row Series (as for evaluate_dataframe); every row is
+      shifted by the same relative amount.
+    - multipliers overrides the default linspace(1 - pct%, 1 + pct%, steps) grid.
+    - Rows that evaluate_dataframe would leave alone (missing rates, or an existing Actual when
+      fill_missing_only) contribute their existing columns to every point, as in compute_summary.
+    Returns one row per candidate; actual_rate is NaN there when the centre is per-row.
+    """
+    k = np.asarray(multipliers, dtype=float) if multipliers is not None else rate_multipliers(pct, steps)
+    df = normalize_df(df)
+
+    if isinstance(actual_rate, pd.Series):
+        centre = pd.to_numeric(actual_rate.reindex(df.index), errors="coerce")
+    else:
+        centre = pd.Series(float(actual_rate), index=df.index)
+    pred = pd.to_numeric(df["Predicted_Rate"], errors="coerce")
+    live = pd.to_numeric(df["Live_Rate"], errors="coerce")
+
+    swept = pred.notna() & live.notna() & centre.notna() & (centre > 0)
+    if fill_missing_only:
+        swept &= df["Actual"].isna()
+    fixed = df[~swept]
+
+    # contributions of rows the sweep does not touch
+    fixed_err = pd.to_numeric(fixed["Error"], errors="coerce").dropna().to_numpy(dtype=float)
+    fixed_dir = pd.to_numeric(fixed["CorrectDirection"], errors="coerce").dropna().to_numpy(dtype=float)
+    fixed_outcomes = fixed["HedgeOutcome"].value_counts()
+
+    m = swept.to_numpy()
+    p, l, c = pred.to_numpy(dtype=float)[m], live.to_numpy(dtype=float)[m], centre.to_numpy(dtype=float)[m]
+    decision = df["Decision"].astype(str).str.strip().to_numpy()[m]
+    ratio = l / c
+
+    # direction is correct when (pred > live) == (candidate > live)
+    up = p > l
+    r_up, r_down = np.sort(ratio[up]), np.sort(ratio[~up])
+    dir_correct = _count_below(r_up, k) + (len(r_down) - _count_below(r_down, k))
+
+    hedge, wait = decision == "Hedge now", decision == "Wait"
+    r_hedge, r_wait = np.sort(ratio[hedge]), np.sort(ratio[wait])
+    profitable = len(r_hedge) - _count_below(r_hedge, k, inclusive=True)
+    good_wait = _count_below(r_wait, k)
+    outcomes = {
+        "Profitable": profitable,
+        "Missed": len(r_hedge) - profitable,
+        "Good Wait": good_wait,
+        "Should've Hedged": len(r_wait) - good_wait,
+        "Unknown": np.full(len(k), int((~hedge & ~wait).sum())),
+    }
+
+    # error = d - delta * c with d = pred - c and delta = k - 1 (kept small for precision)
+    d = p - c
+    delta = k - 1.0
+    n_swept = len(p)
+    err_n = n_swept + len(fixed_err)
+    err_sum = (d.sum() - delta * c.sum()) + fixed_err.sum()
+    err_sq = (np.dot(d, d) - 2.0 * delta * np.dot(d, c) + delta ** 2 * np.dot(c, c)) + np.dot(fixed_err, fixed_err)
+    dir_n = n_swept + len(fixed_dir)
+    dir_sum = dir_correct + fixed_dir.sum()
+    rows_evaluated = n_swept + int(fixed["Actual"].notna().sum())
+
+    out = pd.DataFrame({
+        "shift_pct": np.round(delta * 100.0, 10),
+        "actual_rate": k * float(actual_rate) if not isinstance(actual_rate, pd.Series) else np.nan,
+        "rows_evaluated": rows_evaluated,
+    })
+    for label, col in _OUTCOME_COLUMNS.items():
+        out[col] = (outcomes[label] + int(fixed_outcomes.get(label, 0))).astype(int)
+    out["percent_profitable"] = (out["profitable"] / rows_evaluated * 100).round(4) if rows_evaluated else np.nan
+    out["mean_error"] = np.round(err_sum / err_n, round_digits) if err_n else np.nan
+    out["rmse"] = np.round(np.sqrt(np.maximum(err_sq, 0.0) / err_n), round_digits) if err_n else np.nan
+    out["directional_accuracy"] = np.round(dir_sum / dir_n, round_digits) if dir_n else np.nan
+    return out[SWEEP_COLUMNS]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+JSON encoding for audit results (summaries, previews, curves, cubes).
+
+dumps() encodes straight from what the audit produces, with no astype(object)/where pass
+over the frames: NaN, NaT and pd.NA become null; numpy scalars and arrays, Timestamps,
+Timedeltas and dates are encoded natively. orjson is used when it is installed (numeric
+columns go through its numpy fast path); otherwise the values are sanitised and handed to
+the standard library encoder.
+
+frame_columns() is the columnar preview layout, {"columns": [...], "data": {col: [...]}},
+which encodes each numeric column as one array instead of one dict per row.
+
+Usage (benchmark against the records + json path):
+  python -m audit.serialize --rows 50 --rows 5000 --pairs 40
+"""
+
+import argparse
+import gzip
+import json
+import math
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+PREVIEW_FORMATS = ("records", "columns")
+
+
+def _default(obj: Any) -> Any:
+    """Values the JSON encoder does not know natively."""
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (pd.Timedelta, timedelta)):
+        return pd.Timedelta(obj).isoformat()
+    if isinstance(obj, np.ndarray):
+        # object or non-contiguous arrays; elements come back through this hook as needed
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset, pd.Index, pd.Series)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _plain(obj: Any) -> Any:
+    """Recursive sanitising for the standard library encoder (no NaN, numpy or pandas values left)."""
+    if isinstance(obj, dict):
+        return {str(k) if not isinstance(k, (str, int, float, bool)) and k is not None else k: _plain(v)
+                for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if obj is None or isinstance(obj, (str, bool, int)):
+        return obj
+    return _plain(_default(obj))
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON bytes for audit results; NaN/NA/NaT -> null, numpy and pandas values encoded natively."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(_plain(obj), allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _column(series: pd.Series):
+    values = series.to_numpy()
+    if values.dtype.kind in "fiub":
+        return np.ascontiguousarray(values)
+    if values.dtype.kind == "M":
+        return series.astype(object).to_numpy()
+    return values
+
+
+def frame_columns(df: pd.DataFrame) -> Dict[str, Any]:
+    """Columnar layout of a frame: column order plus one value array per column."""
+    return {"columns": [str(c) for c in df.columns], "data": {str(c): _column(df[c]) for c in df.columns}}
+
+
+def frame_records(df: pd.DataFrame):
+    """Row records; missing values are left as NaN/NA/NaT for dumps to turn into null."""
+    return df.to_dict(orient="records")
+
+
+def frame_payload(df: pd.DataFrame, fmt: str = "records"):
+    if fmt not in PREVIEW_FORMATS:
+        raise ValueError(f"format must be one of {PREVIEW_FORMATS}")
+    return frame_columns(df) if fmt == "columns" else frame_records(df)
+
+
+def _legacy_records(df: pd.DataFrame):
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def _bench_frame(rows: int, pairs: int, seed: int = 0) -> pd.DataFrame:
+    from audit.evaluator import evaluate_dataframe
+
+    rng = np.random.default_rng(seed)
+    live = 0.6 * (1 + rng.normal(0, 0.005, rows))
+    df = pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=rows, freq="min"),
+        "Predicted_Rate": live * (1 + rng.normal(0, 0.003, rows)),
+        "Live_Rate": live,
+        "Decision": rng.choice(["Hedge now", "Wait", None], rows),
+        "Pair": [f"P{i:03d}/USD" for i in rng.integers(0, pairs, rows)],
+        "Notional": rng.integers(10_000, 1_000_000, rows),
+    })
+    for m in ("A", "B", "C"):
+        df[f"Predicted_Rate_{m}"] = live * (1 + rng.normal(0, 0.003, rows))
+    actual = pd.Series(np.where(rng.random(rows) < 0.8, 0.6, np.nan), index=df.index)
+    return evaluate_dataframe(df, actual_rate=actual)
+
+
+def _timed(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark audit response encoding against the records + json path")
+    p.add_argument("--rows", type=int, action="append", help="Preview sizes to encode (repeatable; default 50 and 5000)")
+    p.add_argument("--pairs", type=int, default=40, help="Distinct pairs (size of summary.by_pair)")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+    from audit.summary import compute_summary
+
+    sizes = args.rows or [50, 5000]
+    frame = _bench_frame(max(sizes), args.pairs)
+    summary = compute_summary(frame, by_pair=True)
+    print(f"encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}; "
+          f"frame has {frame.shape[1]} columns; summary.by_pair has {len(summary['by_pair'])} pairs")
+    print(f"{'payload':<30}{'path':<22}{'ms':>9}{'bytes':>12}{'gzip bytes':>12}")
+    for n in sizes:
+        preview = frame.head(n)
+        paths = {
+            "records + json (today)": lambda: json.dumps({"summary": summary, "preview": _legacy_records(preview)},
+                                                         default=str).encode(),
+            "records + dumps": lambda: dumps({"summary": summary, "preview": frame_records(preview)}),
+            "columns + dumps": lambda: dumps({"summary": summary, "preview": frame_columns(preview)}),
+        }
+        for name, fn in paths.items():
+            seconds, body = _timed(fn, args.repeat)
+            print(f"{f'summary + {n} preview rows':<30}{name:<22}{seconds * 1000:>9.2f}{len(body):>12,}"
+                  f"{len(gzip.compress(body, 6)):>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable error-distribution sketches.
+
+QuantileSketch is a KLL-style compactor sketch: level h holds items of weight 2**h and
+is halved into level h+1 when it outgrows its capacity. Memory stays O(k log(n/k))
+and two sketches merge by concatenating levels and compacting again, so distributions
+from chunks, files or days can be combined without re-reading rows.
+
+ErrorHistogram uses fixed-width bins keyed by integer bin index. When it holds more than
+max_bins bins the width doubles (adjacent bins are added), so its size stays bounded at any
+error scale; histograms whose widths differ by a power of two merge by coarsening the finer
+one and adding counts.
+
+Both serialise to plain JSON-friendly dicts (to_dict / from_dict).
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_K = 200
+DEFAULT_BIN_WIDTH = 0.0001
+DEFAULT_MAX_BINS = 256
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+_CAPACITY_DECAY = 2.0 / 3.0
+
+
+class QuantileSketch:
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = int(k)
+        self.n = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._coin = 0
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(2, int(math.ceil(self.k * _CAPACITY_DECAY ** depth)))
+
+    def _compact(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # the largest items (half a level's capacity) stay at this level, so the tail (p90, p99)
+            # is compacted far less often than the body and keeps its precision
+            top = items[len(items) - self._capacity(level) // 2:]
+            lower = items[: len(items) - len(top)]
+            keep = lower[-1:] if len(lower) % 2 else lower[:0]
+            pairs = lower[: len(lower) - len(keep)]
+            # alternate which half survives so successive compactions cancel each other's bias
+            promoted = pairs[self._coin::2]
+            self._coin ^= 1
+            self.levels[level] = np.concatenate([keep, top])
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values: Iterable[float]) -> "QuantileSketch":
+        arr = np.asarray(values, dtype=float)
+        arr = arr[~np.isnan(arr)]
+        if arr.size == 0:
+            return self
+        self.n += int(arr.size)
+        lo, hi = float(arr.min()), float(arr.max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        self.levels[0] = np.concatenate([self.levels[0], arr])
+        self._compact()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compact()
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Nearest-rank quantile estimate; exact while n fits in level 0."""
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2 ** h, dtype=np.int64) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cum = np.cumsum(weights[order])
+        idx = int(np.searchsorted(cum, q * cum[-1], side="left"))
+        return float(items[order][min(idx, len(items) - 1)])
+
+    def to_dict(self) -> Dict:
+        return {
+            "k": self.k,
+            "n": self.n,
+            "min": self.min,
+            "max": self.max,
+            "levels": [lvl.tolist() for lvl in self.levels],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "QuantileSketch":
+        sketch = cls(k=data.get("k", DEFAULT_K))
+        sketch.n = int(data.get("n", 0))
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        sketch.levels = [np.asarray(lvl, dtype=float) for lvl in data.get("levels", [[]])] or [np.empty(0)]
+        return sketch
+
+
+class ErrorHistogram:
+    def __init__(self, bin_width: float = DEFAULT_BIN_WIDTH, max_bins: int = DEFAULT_MAX_BINS):
+        self.bin_width = float(bin_width)
+        self.max_bins = int(max_bins)
+        self.counts: Dict[int, int] = {}
+
+    @staticmethod
+    def _coarsened(counts: Dict[int, int], factor: int) -> Dict[int, int]:
+        # floor(floor(x / w) / f) == floor(x / (w * f)), so coarsened bins match bins built at the wider width
+        out: Dict[int, int] = {}
+        for b, c in counts.items():
+            out[b // factor] = out.get(b // factor, 0) + c
+        return out
+
+    def _fit(self) -> None:
+        while len(self.counts) > self.max_bins:
+            self.counts = self._coarsened(self.counts, 2)
+            self.bin_width *= 2
+
+    def update(self, values: Iterable[float]) -> "ErrorHistogram":
+        arr = np.asarray(values, dtype=float)
+        arr = arr[~np.isnan(arr)]
+        if arr.size == 0:
+            return self
+        bins, counts = np.unique(np.floor(arr / self.bin_width).astype(np.int64), return_counts=True)
+        for b, c in zip(bins.tolist(), counts.tolist()):
+            self.counts[b] = self.counts.get(b, 0) + c
+        self._fit()
+        return self
+
+    def merge(self, other: "ErrorHistogram") -> "ErrorHistogram":
+        ratio = max(self.bin_width, other.bin_width) / min(self.bin_width, other.bin_width)
+        factor = 2 ** int(round(math.log2(ratio)))
+        if not math.isclose(ratio, factor):
+            raise ValueError(f"Cannot merge histograms with bin widths {self.bin_width} and {other.bin_width}")
+        other_counts = other.counts
+        if other.bin_width > self.bin_width and factor > 1:
+            self.counts = self._coarsened(self.counts, factor)
+            self.bin_width = other.bin_width
+        elif factor > 1:
+            other_counts = self._coarsened(other.counts, factor)
+        for b, c in other_counts.items():
+            self.counts[b] = self.counts.get(b, 0) + c
+        self._fit()
+        return self
+
+    def to_series(self) -> pd.Series:
+        """Counts indexed by bin lower edge, sorted."""
+        keys = sorted(self.counts)
+        return pd.Series([self.counts[b] for b in keys], index=[round(b * self.bin_width, 10) for b in keys], dtype="int64")
+
+    def to_dict(self) -> Dict:
+        return {"bin_width": self.bin_width, "max_bins": self.max_bins,
+                "counts": {str(b): c for b, c in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ErrorHistogram":
+        hist = cls(bin_width=data.get("bin_width", DEFAULT_BIN_WIDTH), max_bins=data.get("max_bins", DEFAULT_MAX_BINS))
+        hist.counts = {int(b): int(c) for b, c in data.get("counts", {}).items()}
+        return hist
+
+
+class ErrorDistribution:
+    """Signed-error histogram plus an absolute-error quantile sketch for one slice of rows."""
+
+    def __init__(self, k: int = DEFAULT_K, bin_width: float = DEFAULT_BIN_WIDTH):
+        self.abs_error = QuantileSketch(k=k)
+        self.histogram = ErrorHistogram(bin_width=bin_width)
+
+    @classmethod
+    def from_errors(cls, errors, **kwargs) -> "ErrorDistribution":
+        dist = cls(**kwargs)
+        arr = pd.to_numeric(pd.Series(errors), errors="coerce").to_numpy(dtype=float)
+        dist.abs_error.update(np.abs(arr))
+        dist.histogram.update(arr)
+        return dist
+
+    def merge(self, other: "ErrorDistribution") -> "ErrorDistribution":
+        self.abs_error.merge(other.abs_error)
+        self.histogram.merge(other.histogram)
+        return self
+
+    def report(self, round_digits: int = 6) -> Dict[str, Optional[float]]:
+        out = {}
+        for name, q in QUANTILES.items():
+            val = self.abs_error.quantile(q)
+            out[name] = round(val, round_digits) if val is not None else None
+        out["max_abs"] = round(self.abs_error.max, round_digits) if self.abs_error.max is not None else None
+        return out
+
+    def to_dict(self) -> Dict:
+        return {"abs_error": self.abs_error.to_dict(), "histogram": self.histogram.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ErrorDistribution":
+        dist = cls()
+        dist.abs_error = QuantileSketch.from_dict(data.get("abs_error", {}))
+        dist.histogram = ErrorHistogram.from_dict(data.get("histogram", {}))
+        return dist
+
+
+def merge_distributions(dists: Iterable[Dict]) -> ErrorDistribution:
+    """Merge serialised ErrorDistribution dicts (e.g. from partitions or days)."""
+    merged: Optional[ErrorDistribution] = None
+    for d in dists:
+        part = ErrorDistribution.from_dict(d)
+        merged = part if merged is None else merged.merge(part)
+    return merged if merged is not None else ErrorDistribution()
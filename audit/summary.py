@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
 
 
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
+import numpy as np
 import pandas as pd
 
+from audit.evaluator import horizon_labels, prediction_models
+from validators import MODEL_PREFIX, parse_row_pairs
+from audit.sketch import ErrorDistribution
+from audit.timestamps import parse_timestamps
+
 DEFAULT_ROUND = 6
+DEFAULT_ROLLING_WINDOW = "7D"
+
+_SUMMARY_PREFIXES = ("Actual", "Error", "CorrectDirection", "HedgeOutcome")
+
+# additive notional measures per pair (see notional_columns)
+NOTIONAL_MEASURES = ["notional", "notional_dir", "notional_correct", "hedged_notional", "open_notional",
+                     "hedge_pnl", "wait_pnl"]
+
+ROLLING_COLUMNS = ["Timestamp", "Pair", "rows_evaluated", "directional_accuracy", "mean_error", "rmse", "percent_profitable"]
 
 def _safe_mean(series: pd.Series) -> Optional[float]:
     s = series.dropna()
@@ -18,16 +33,127 @@ def _get_date_range(df: pd.DataFrame, ts_col: str = "Timestamp") -> Optional[Dic
     if ts_col not in df.columns:
         return None
     try:
-        ts = pd.to_datetime(df[ts_col], errors="coerce").dropna()
+        ts = parse_timestamps(df[ts_col]).dropna()
         if ts.empty:
             return None
         return {"min": ts.min().isoformat(), "max": ts.max().isoformat()}
     except Exception:
         return None
 
-def compute_summary(df: pd.DataFrame, round_digits: int = DEFAULT_ROUND, by_pair: bool = False) -> Dict:
-    # defensive copy
-    df = df.copy()
+def _outcome_metrics(df: pd.DataFrame, suffix: str, round_digits: int, evaluated_col: Optional[str] = None) -> Dict:
+    """
+    Evaluation metrics from the Actual/Error/CorrectDirection/HedgeOutcome columns ending in suffix.
+    Rows evaluated are counted on evaluated_col (default Actual<suffix>).
+    """
+    rows_evaluated = int(df[evaluated_col or "Actual" + suffix].notna().sum())
+    mean_error = _safe_mean(df["Error" + suffix])
+    rmse = _safe_rmse(df["Error" + suffix])
+    directional_acc = _safe_mean(df["CorrectDirection" + suffix].astype("float", errors="ignore"))
+    profitable_hedges = int((df["HedgeOutcome" + suffix] == "Profitable").sum())
+    missed_hedges = int((df["HedgeOutcome" + suffix] == "Should've Hedged").sum())
+    return {
+        "rows_evaluated": rows_evaluated,
+        "mean_error": round(mean_error, round_digits) if mean_error is not None else None,
+        "rmse": round(rmse, round_digits) if rmse is not None else None,
+        "directional_accuracy": round(directional_acc, round_digits) if directional_acc is not None else None,
+        "profitable_hedges": profitable_hedges,
+        "missed_hedges": missed_hedges,
+        "percent_profitable": round((profitable_hedges / rows_evaluated) * 100, 4) if rows_evaluated else None,
+    }
+
+def notional_columns(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Per-row NOTIONAL_MEASURES (all additive, so chunks, partitions and cube cells merge by sum).
+    - notional_dir / notional_correct: the value_weighted_accuracy terms
+    - hedged_notional / open_notional: notional on "Hedge now" / "Wait" rows
+    - hedge_pnl: Notional * (Live_Rate - Actual) on evaluated "Hedge now" rows, i.e. what locking in
+      the live rate made against waiting; wait_pnl: Notional * (Actual - Live_Rate) on evaluated
+      "Wait" rows, what waiting made against hedging. Both are in quote-currency units.
+    """
+    notional = _numeric(df, "Notional").to_numpy(dtype=float)
+    notional = np.where(np.isnan(notional), 0.0, notional)
+    correct = _numeric(df, "CorrectDirection").to_numpy(dtype=float)
+    dir_ok = ~np.isnan(correct)
+    # Live_Rate - Actual: positive when the rate fell after the decision, i.e. hedging paid off
+    move = (_numeric(df, "Live_Rate") - _numeric(df, "Actual")).to_numpy(dtype=float)
+    priced = ~np.isnan(move)
+    hedge, wait = _decision_masks(df)
+    return {
+        "notional": notional,
+        "notional_dir": np.where(dir_ok, notional, 0.0),
+        "notional_correct": np.where(dir_ok, notional * correct, 0.0),
+        "hedged_notional": np.where(hedge, notional, 0.0),
+        "open_notional": np.where(wait, notional, 0.0),
+        "hedge_pnl": np.where(hedge & priced, notional * move, 0.0),
+        "wait_pnl": np.where(wait & priced, -notional * move, 0.0),
+    }
+
+def _notional_sums(df: pd.DataFrame, codes: np.ndarray, groups: int) -> Dict[str, np.ndarray]:
+    """NOTIONAL_MEASURES per group code in one bincount pass."""
+    return {m: np.bincount(codes, weights=values, minlength=groups) for m, values in notional_columns(df).items()}
+
+def _decision_masks(df: pd.DataFrame):
+    """"Hedge now" / "Wait" row masks; labels are stripped once per distinct Decision, not per row."""
+    if "Decision" not in df.columns:
+        none = np.zeros(len(df), dtype=bool)
+        return none, none
+    codes, labels = pd.factorize(df["Decision"])
+    labels = pd.Index(labels).astype(str).str.strip()
+    return (np.isin(codes, np.flatnonzero(labels == "Hedge now")),
+            np.isin(codes, np.flatnonzero(labels == "Wait")))
+
+def _value_weighted_accuracy(sums, round_digits: int) -> Optional[float]:
+    if sums["notional_dir"] <= 0:
+        return None
+    return round(float(sums["notional_correct"] / sums["notional_dir"]), round_digits)
+
+def _notional_metrics(sums, round_digits: int) -> Dict:
+    """Notional-weighted accuracy, hedge vs wait P&L and exposure from one pair's NOTIONAL_MEASURES sums."""
+    return {
+        "value_weighted_accuracy": _value_weighted_accuracy(sums, round_digits),
+        "pnl": _pnl(sums),
+        "exposure": _exposure(sums),
+    }
+
+def _book_metrics(by_pair: pd.DataFrame, round_digits: int) -> Dict:
+    """
+    Book-level notional metrics from per-pair NOTIONAL_MEASURES sums. Amounts are only added up
+    within one currency: P&L per quote currency (the currency it is in), exposure per base
+    currency (the currency Notional is in) and per pair; pairs that do not parse count as UNKNOWN.
+    """
+    keys = parse_row_pairs(pd.DataFrame({"Pair": by_pair.index})).where(by_pair.index != "UNKNOWN")
+    currencies = keys.str.split("/", expand=True).reindex(columns=[0, 1]).fillna("UNKNOWN")
+    by_quote = by_pair.groupby(currencies[1].to_numpy()).sum()
+    by_base = by_pair.groupby(currencies[0].to_numpy()).sum()
+    return {
+        "value_weighted_accuracy": _value_weighted_accuracy(by_pair.sum(), round_digits),
+        "pnl_by_currency": {ccy: _pnl(sums) for ccy, sums in by_quote.iterrows()},
+        "exposure_by_currency": {ccy: _exposure(sums) for ccy, sums in by_base.iterrows()},
+        "exposure_by_pair": {pair: _exposure(sums) for pair, sums in by_pair.iterrows()},
+    }
+
+def _pnl(sums) -> Dict:
+    hedge_pnl, wait_pnl = float(sums["hedge_pnl"]), float(sums["wait_pnl"])
+    return {"hedge": round(hedge_pnl, 2), "wait": round(wait_pnl, 2), "total": round(hedge_pnl + wait_pnl, 2)}
+
+def _exposure(sums) -> Dict:
+    notional, hedged = float(sums["notional"]), float(sums["hedged_notional"])
+    return {
+        "notional": round(notional, 2),
+        "hedged": round(hedged, 2),
+        "open": round(float(sums["open_notional"]), 2),
+        "hedge_ratio": round(hedged / notional, 4) if notional else None,
+    }
+
+def model_metrics(df: pd.DataFrame, round_digits: int = DEFAULT_ROUND) -> Dict:
+    """Side-by-side model comparison (model x metric) from evaluate_dataframe's per-model columns."""
+    models = [name for name in prediction_models(df) if f"Error_{name}" in df.columns]
+    return {name: _outcome_metrics(df, f"_{name}", round_digits, evaluated_col=f"Error_{name}") for name in models}
+
+def compute_summary(df: pd.DataFrame, round_digits: int = DEFAULT_ROUND, by_pair: bool = False,
+                    include_sketch: bool = False) -> Dict:
+    # shallow copy: only the missing columns are materialised, the rest are read in place
+    df = df.copy(deep=False)
 
     # ensure cols exist
     for c in ["Actual", "Error", "CorrectDirection", "HedgeOutcome", "Pair"]:
@@ -35,38 +161,226 @@ def compute_summary(df: pd.DataFrame, round_digits: int = DEFAULT_ROUND, by_pair
             df[c] = pd.NA
 
     total = int(len(df))
-    rows_evaluated = int(df["Actual"].notna().sum())
-
-    mean_error = _safe_mean(df["Error"])
-    rmse = _safe_rmse(df["Error"])
-    directional_acc = _safe_mean(df["CorrectDirection"].astype("float", errors="ignore")) if "CorrectDirection" in df else None
-
-    profitable_hedges = int((df["HedgeOutcome"] == "Profitable").sum())
-    missed_hedges = int((df["HedgeOutcome"] == "Should've Hedged").sum())
-
-    percent_profitable = round((profitable_hedges / rows_evaluated) * 100, 4) if rows_evaluated else None
+    metrics = _outcome_metrics(df, "", round_digits)
+    rows_evaluated = metrics["rows_evaluated"]
     percent_missing_actuals = round(((total - rows_evaluated) / total) * 100, 4) if total else None
 
     date_range = _get_date_range(df, "Timestamp")
+    error_dist = ErrorDistribution.from_errors(df["Error"])
 
     summary = {
         "total_rows": total,
         "rows_evaluated": rows_evaluated,
         "percent_missing_actuals": percent_missing_actuals,
-        "mean_error": round(mean_error, round_digits) if mean_error is not None else None,
-        "rmse": round(rmse, round_digits) if rmse is not None else None,
-        "directional_accuracy": round(directional_acc, round_digits) if directional_acc is not None else None,
-        "profitable_hedges": profitable_hedges,
-        "missed_hedges": missed_hedges,
-        "percent_profitable": percent_profitable,
-        "date_range": date_range
+        "mean_error": metrics["mean_error"],
+        "rmse": metrics["rmse"],
+        "directional_accuracy": metrics["directional_accuracy"],
+        "profitable_hedges": metrics["profitable_hedges"],
+        "missed_hedges": metrics["missed_hedges"],
+        "percent_profitable": metrics["percent_profitable"],
+        "date_range": date_range,
+        "abs_error_quantiles": error_dist.report(round_digits),
     }
+    horizons = horizon_labels(df)
+    if horizons:
+        # horizon x metric matrix from evaluate_horizons columns
+        summary["horizons"] = {h: _outcome_metrics(df, f"_{h}", round_digits) for h in horizons}
+    models = model_metrics(df, round_digits)
+    if models:
+        summary["models"] = models
+    if include_sketch:
+        # serialisable, mergeable across chunks/files/days via audit.sketch.merge_distributions
+        summary["error_sketch"] = error_dist.to_dict()
+
+    notional = None
+    if "Notional" in df.columns:
+        # one grouped pass: per-pair sums give the per-currency totals, the exposure table and the by_pair entries
+        codes, pairs = pd.factorize(df["Pair"].fillna("UNKNOWN").astype(str), sort=True)
+        notional = pd.DataFrame(_notional_sums(df, codes, len(pairs)), index=pairs)
+        summary.update(_book_metrics(notional, round_digits))
 
     if by_pair:
+        # per-pair slices carry only the columns a summary reads, not the whole frame
+        cols = [c for c in df.columns if c == "Timestamp" or c == "Pair" or c.startswith(_SUMMARY_PREFIXES)
+                or (c.startswith(MODEL_PREFIX) and f"Error_{c[len(MODEL_PREFIX):]}" in df.columns)]
+        positions = [df.columns.get_loc(c) for c in cols]
         pair_grp = {}
-        for pair, sub in df.groupby(df["Pair"].fillna("UNKNOWN")):
-            pair_summary = compute_summary(sub, round_digits=round_digits, by_pair=False)
+        for pair, rows in sorted(df.groupby(df["Pair"].fillna("UNKNOWN")).indices.items()):
+            sub = df.iloc[rows, positions]
+            pair_summary = compute_summary(sub, round_digits=round_digits, by_pair=False, include_sketch=include_sketch)
+            if notional is not None:
+                pair_summary.update(_notional_metrics(notional.loc[str(pair)], round_digits))
             pair_grp[str(pair)] = pair_summary
         summary["by_pair"] = pair_grp
 
     return summary
+
+PARTIAL_KEYS = ["Pair", "kind", "name"]
+PARTIAL_MEASURES = ["rows", "evaluated", "err_n", "err_sum", "err_sq", "dir_n", "dir_sum", "profitable", "missed"]
+_COUNT_MEASURES = ["rows", "evaluated", "err_n", "dir_n", "profitable", "missed"]
+
+def _numeric(df: pd.DataFrame, col: str) -> pd.Series:
+    if col not in df.columns:
+        return pd.Series(float("nan"), index=df.index)
+    return pd.to_numeric(df[col], errors="coerce")
+
+def summary_partials(df: pd.DataFrame, ts_col: str = "Timestamp") -> Dict:
+    """
+    compute_summary's mergeable pieces for one slice of an audited frame (a chunk or a partition):
+    - measures: additive sums per (Pair, kind, name), kind "" for the primary columns,
+      "horizon" per evaluate_horizons label and "model" per Predicted_Rate_<model>
+    - bounds: first/last timestamp per pair
+    - sketches: ErrorDistribution per pair plus "ALL"
+    - notional: NOTIONAL_MEASURES per pair (None without a Notional column)
+    Slices combine with merge_summary_partials; summary_from_partials turns the result into
+    the dict compute_summary returns for the whole frame.
+    """
+    pair = (df["Pair"] if "Pair" in df.columns else pd.Series(pd.NA, index=df.index)).fillna("UNKNOWN").astype(str)
+    horizons = horizon_labels(df)
+    models = [name for name in prediction_models(df) if f"Error_{name}" in df.columns]
+    scopes = [("", "", "", "Actual")]
+    scopes += [("horizon", h, f"_{h}", f"Actual_{h}") for h in horizons]
+    scopes += [("model", m, f"_{m}", f"Error_{m}") for m in models]
+
+    # one pass per scope: every measure is a bincount over the pair codes
+    codes, pairs = pd.factorize(pair, sort=True)
+    frames = []
+    for kind, name, suffix, evaluated_col in scopes:
+        error = _numeric(df, "Error" + suffix).to_numpy(dtype=float)
+        correct = _numeric(df, "CorrectDirection" + suffix).to_numpy(dtype=float)
+        outcome = df["HedgeOutcome" + suffix] if "HedgeOutcome" + suffix in df.columns else pd.Series(pd.NA, index=df.index)
+        evaluated = df[evaluated_col].notna().to_numpy() if evaluated_col in df.columns else np.zeros(len(df), dtype=bool)
+        err_ok, dir_ok = ~np.isnan(error), ~np.isnan(correct)
+        columns = {
+            "rows": np.ones(len(df)),
+            "evaluated": evaluated,
+            "err_n": err_ok,
+            "err_sum": np.where(err_ok, error, 0.0),
+            "err_sq": np.where(err_ok, error ** 2, 0.0),
+            "dir_n": dir_ok,
+            "dir_sum": np.where(dir_ok, correct, 0.0),
+            "profitable": (outcome == "Profitable").to_numpy(),
+            "missed": (outcome == "Should've Hedged").to_numpy(),
+        }
+        sums = {m: np.bincount(codes, weights=values, minlength=len(pairs)) for m, values in columns.items()}
+        frame = pd.DataFrame(sums, index=pd.MultiIndex.from_product([pairs, [kind], [name]], names=PARTIAL_KEYS))
+        frames.append(frame.astype({m: int for m in _COUNT_MEASURES}))
+    measures = pd.concat(frames)[PARTIAL_MEASURES]
+    notional = None
+    if "Notional" in df.columns:
+        notional = pd.DataFrame(_notional_sums(df, codes, len(pairs)), index=pd.Index(pairs, name="Pair"))
+
+    bounds = None
+    if ts_col in df.columns:
+        try:
+            ts = parse_timestamps(df[ts_col])
+            bounds = ts.groupby(pair).agg(["min", "max"])
+        except Exception:
+            bounds = None
+
+    error = _numeric(df, "Error").to_numpy(dtype=float)
+    sketches = {"ALL": ErrorDistribution.from_errors(error)}
+    for j, key in enumerate(pairs):
+        sketches[key] = ErrorDistribution.from_errors(error[codes == j])
+    return {"measures": measures, "bounds": bounds, "sketches": sketches, "horizons": horizons, "models": models,
+            "notional": notional}
+
+def merge_summary_partials(partials: Iterable[Dict]) -> Dict:
+    """Combine summary_partials from chunks, partitions or files (same columns expected)."""
+    partials = list(partials)
+    measures = pd.concat([p["measures"] for p in partials]).groupby(level=PARTIAL_KEYS, sort=False).sum()
+    bounds = [p["bounds"] for p in partials if p["bounds"] is not None]
+    if bounds:
+        stacked = pd.concat(bounds)
+        bounds = stacked.groupby(level=0).agg({"min": "min", "max": "max"})
+    else:
+        bounds = None
+    notional = [p["notional"] for p in partials if p.get("notional") is not None]
+    notional = pd.concat(notional).groupby(level=0).sum() if notional else None
+    sketches: Dict[str, ErrorDistribution] = {}
+    for p in partials:
+        for key, dist in p["sketches"].items():
+            sketches.setdefault(key, ErrorDistribution()).merge(dist)
+    return {
+        "measures": measures,
+        "bounds": bounds,
+        "sketches": sketches,
+        "horizons": list(dict.fromkeys(h for p in partials for h in p["horizons"])),
+        "models": list(dict.fromkeys(m for p in partials for m in p["models"])),
+        "notional": notional,
+    }
+
+def _metrics_from_sums(sums: pd.Series, round_digits: int) -> Dict:
+    """_outcome_metrics from one row of summed measures."""
+    rows_evaluated = int(sums["evaluated"])
+    profitable_hedges = int(sums["profitable"])
+    mean_error = sums["err_sum"] / sums["err_n"] if sums["err_n"] else None
+    rmse = (sums["err_sq"] / sums["err_n"]) ** 0.5 if sums["err_n"] else None
+    directional_acc = sums["dir_sum"] / sums["dir_n"] if sums["dir_n"] else None
+    return {
+        "rows_evaluated": rows_evaluated,
+        "mean_error": round(float(mean_error), round_digits) if mean_error is not None else None,
+        "rmse": round(float(rmse), round_digits) if rmse is not None else None,
+        "directional_accuracy": round(float(directional_acc), round_digits) if directional_acc is not None else None,
+        "profitable_hedges": profitable_hedges,
+        "missed_hedges": int(sums["missed"]),
+        "percent_profitable": round((profitable_hedges / rows_evaluated) * 100, 4) if rows_evaluated else None,
+    }
+
+def summary_from_partials(partials: Dict, round_digits: int = DEFAULT_ROUND, by_pair: bool = False,
+                          include_sketch: bool = False, pair: Optional[str] = None) -> Dict:
+    """compute_summary's dict from (merged) summary_partials; pair restricts it to one pair."""
+    measures = partials["measures"]
+    bounds = partials["bounds"]
+    if pair is not None:
+        measures = measures.xs(pair, level="Pair", drop_level=False)
+        bounds = bounds.loc[[pair]] if bounds is not None and pair in bounds.index else None
+    sums = measures.groupby(level=["kind", "name"], sort=False).sum()
+
+    def _metrics(kind: str, name: str) -> Dict:
+        row = sums.loc[(kind, name)] if (kind, name) in sums.index else pd.Series(0, index=PARTIAL_MEASURES)
+        return _metrics_from_sums(row, round_digits)
+
+    metrics = _metrics("", "")
+    total = int(sums.loc[("", ""), "rows"]) if ("", "") in sums.index else 0
+    rows_evaluated = metrics["rows_evaluated"]
+    date_range = None
+    if bounds is not None and not bounds.empty and pd.notna(bounds["min"].min()):
+        date_range = {"min": bounds["min"].min().isoformat(), "max": bounds["max"].max().isoformat()}
+    error_dist = partials["sketches"].get("ALL" if pair is None else pair, ErrorDistribution())
+
+    summary = {
+        "total_rows": total,
+        "rows_evaluated": rows_evaluated,
+        "percent_missing_actuals": round(((total - rows_evaluated) / total) * 100, 4) if total else None,
+        "mean_error": metrics["mean_error"],
+        "rmse": metrics["rmse"],
+        "directional_accuracy": metrics["directional_accuracy"],
+        "profitable_hedges": metrics["profitable_hedges"],
+        "missed_hedges": metrics["missed_hedges"],
+        "percent_profitable": metrics["percent_profitable"],
+        "date_range": date_range,
+        "abs_error_quantiles": error_dist.report(round_digits),
+    }
+    if partials["horizons"]:
+        summary["horizons"] = {h: _metrics("horizon", h) for h in partials["horizons"]}
+    if partials["models"]:
+        summary["models"] = {m: _metrics("model", m) for m in partials["models"]}
+    if include_sketch:
+        summary["error_sketch"] = error_dist.to_dict()
+
+    notional = partials.get("notional")
+    if notional is not None:
+        if pair is None:
+            summary.update(_book_metrics(notional, round_digits))
+        else:
+            sums = notional.loc[pair] if pair in notional.index else pd.Series(0.0, index=NOTIONAL_MEASURES)
+            summary.update(_notional_metrics(sums, round_digits))
+
+    if by_pair:
+        pairs = sorted(measures.index.get_level_values("Pair").unique())
+        summary["by_pair"] = {
+            p: summary_from_partials(partials, round_digits=round_digits, include_sketch=include_sketch, pair=p)
+            for p in pairs
+        }
+    return summary
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Shared timestamp parsing.
+
+parse_timestamps sniffs one strptime format from a sample of the distinct values,
+parses only the distinct values with that fixed format and broadcasts the result back
+to every row. Values the sniffed format cannot read fall back to per-value inference.
+Columns that are already datetime64 are returned untouched, so once a stage stores the
+parsed column (validators.validate_rows does) later stages never parse it again.
+
+Slash dates are read month-first, like pandas, unless a value rules that out (a day
+above 12), in which case the whole column is read day-first. A file parsed in chunks
+should fix the format once (detect_format on the first chunk) and pass it as fmt, so
+every chunk reads ambiguous dates the same way. Values carrying UTC offsets come back in
+UTC, so the result is datetime64 even when the offsets differ between rows.
+"""
+
+import warnings
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype
+
+SNIFF_SAMPLE = 200
+NAT_NS = np.iinfo(np.int64).min
+
+# most specific first; the first format that reads the whole sample wins
+CANDIDATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%m/%d/%Y %H:%M",
+    "%d/%m/%Y %H:%M",
+    "%Y%m%d",
+]
+# month-first formats and their day-first twins (used when some value cannot be month-first)
+DAY_FIRST_TWINS = {"%m/%d/%Y": "%d/%m/%Y", "%m/%d/%Y %H:%M": "%d/%m/%Y %H:%M"}
+
+
+def sniff_format(values: Sequence[str], formats: Optional[List[str]] = None) -> Optional[str]:
+    """Return the candidate format that parses the most of a sample of values (None if none do)."""
+    sample = pd.Series(list(values[:SNIFF_SAMPLE]), dtype=object)
+    if sample.empty:
+        return None
+    best, best_ok = None, 0
+    for fmt in formats or CANDIDATE_FORMATS:
+        ok = int(pd.to_datetime(sample, format=fmt, errors="coerce", utc=True).notna().sum())
+        if ok > best_ok:
+            best, best_ok = fmt, ok
+        if ok == len(sample):
+            break
+    return best
+
+
+def _infer_each(values: pd.Series, utc: bool) -> pd.Series:
+    try:
+        return pd.to_datetime(values, errors="coerce", utc=utc, format="mixed")
+    except (TypeError, ValueError):
+        # pandas < 2.0 has no format="mixed"; its default already infers per value
+        return pd.to_datetime(values, errors="coerce", utc=utc)
+
+
+def _distinct_text(s: pd.Series) -> Tuple[np.ndarray, pd.Series]:
+    codes, uniques = pd.factorize(s)
+    return codes, pd.Series(uniques, dtype=object).astype(str).str.strip()
+
+def _resolve_format(text: pd.Series) -> Optional[str]:
+    """Sniffed format for distinct values, switched to its day-first twin when any value needs it."""
+    fmt = sniff_format(text.tolist())
+    twin = DAY_FIRST_TWINS.get(fmt)
+    if twin is not None:
+        month_first = int(pd.to_datetime(text, format=fmt, errors="coerce").notna().sum())
+        if month_first < len(text) and int(pd.to_datetime(text, format=twin, errors="coerce").notna().sum()) > month_first:
+            return twin
+    return fmt
+
+def detect_format(values) -> Optional[str]:
+    """The format parse_timestamps would use for values (None when already datetime64 or nothing matches)."""
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    if is_datetime64_any_dtype(s):
+        return None
+    _, text = _distinct_text(s)
+    return _resolve_format(text) if len(text) else None
+
+def _parse_text(text: pd.Series, fmt: Optional[str], utc: bool) -> pd.Series:
+    if fmt is None:
+        return _infer_each(text, utc)
+    parsed = pd.to_datetime(text, format=fmt, errors="coerce", utc=utc)
+    failed = parsed.isna()
+    if failed.any():
+        parsed = parsed.where(~failed, _infer_each(text[failed], utc))
+    return parsed
+
+def parse_timestamps(values, utc: bool = False, fmt: Optional[str] = None) -> pd.Series:
+    """
+    Parse a timestamp column to datetime64 (NaT where unparseable), keeping the input index.
+    fmt fixes the format (e.g. detect_format of a file's first chunk) instead of sniffing it.
+    Naive values stay naive unless utc; values with UTC offsets are always converted to UTC.
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    if is_datetime64_any_dtype(s):
+        if utc:
+            return s.dt.tz_localize("UTC") if s.dt.tz is None else s.dt.tz_convert("UTC")
+        return s
+
+    codes, text = _distinct_text(s)
+    if len(text) == 0:
+        return pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns, UTC]" if utc else "datetime64[ns]")
+
+    if fmt is None:
+        fmt = _resolve_format(text)
+    with warnings.catch_warnings():
+        # mixed offsets parsed without utc: pandas warns and returns objects (or raises); redone in UTC below
+        warnings.simplefilter("ignore", FutureWarning)
+        try:
+            parsed = _parse_text(text, fmt, utc or (fmt is not None and "%z" in fmt))
+        except ValueError:
+            parsed = None
+    if parsed is None or not is_datetime64_any_dtype(parsed):
+        parsed = _parse_text(text, fmt, True)
+    elif parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_convert("UTC")
+
+    out = parsed.take(np.where(codes >= 0, codes, 0))
+    out.index = s.index
+    return out.where(codes >= 0)
+
+
+def to_utc_ns(values, fmt: Optional[str] = None) -> np.ndarray:
+    """
+    Timestamps (strings, datetimes, scalars) -> int64 ns UTC; naive values are taken as UTC, unparseable ones become NAT_NS.
+    fmt fixes the format as in parse_timestamps.
+    """
+    ts = parse_timestamps(pd.Series(np.atleast_1d(values)), utc=True, fmt=fmt)
+    return ts.dt.tz_convert(None).to_numpy(dtype="datetime64[ns]").view(np.int64)
@@ -10,17 +10,26 @@ CLI wrapper for running a hedge audit on one or more CSV files.
 Usage examples:
   python entrypoint.py --file hedge_log_nzdusd.csv --actual 0.61123
   python entrypoint.py --file hedge_log_nzdusd.csv --infer-pair --as-of-yesterday
+  python entrypoint.py --file hedge_log_nzdusd.csv --actual 0.61123 --rolling-window 30D
+  python entrypoint.py --file hedge_log_nzdusd.csv --rate-archive rates/ --archive-horizon 1D
+  python entrypoint.py --file hedge_log_nzdusd.csv --actual 0.61123 --rate-archive rates/ --backtest-horizons 1D,7D,30D
+  python entrypoint.py --file hedge_log_nzdusd.csv --actual 0.61123 --sweep 2 --sweep-steps 41
+  python entrypoint.py --file big_hedge_log.csv --actual 0.61123 --workers 0
 """
 
 import argparse
+import json
 import sys
-from datetime import datetime, timedelta
 import pandas as pd
 
-from audit.evaluator import evaluate_dataframe
+from audit.evaluator import evaluate_dataframe, evaluate_horizons
 from audit.summary import compute_summary
-from ingest.rate_fetcher import fetch_actual_rate  # implement this per earlier plan
-from validators import infer_pair_from_df_or_filename  # implement this helper
+from audit.cube import build_cube, rolling_from_cube
+from audit.parallel import audit_partitioned
+from audit.sensitivity import sweep_actual_rates, DEFAULT_SWEEP_STEPS
+from ingest.rate_fetcher import fetch_rate_with_age, fetch_actual_rates, yesterday_eod  # implement this per earlier plan
+from ingest.rate_archive import RateArchive
+from validators import infer_pair_from_df_or_filename, parse_row_pairs, unique_pairs, validate_rows  # implement this helper
 
 def _read_csv(path: str) -> pd.DataFrame:
     try:
@@ -37,24 +46,69 @@ def main():
     p.add_argument("--actual", "-a", type=float, help="Actual rate to use for evaluation (optional)")
     p.add_argument("--infer-pair", action="store_true", help="Infer currency pair from file or data when actual not provided")
     p.add_argument("--as-of-yesterday", action="store_true", help="If inferring rate, fetch rate as of yesterday (23:59) instead of now")
+    p.add_argument("--max-staleness", type=float, help="Serve a cached provider rate up to this many seconds old (refreshed in the background)")
+    p.add_argument("--rate-archive", help="Resolve actual rates offline from a local rate archive directory (see ingest.rate_archive)")
+    p.add_argument("--archive-horizon", help="With --rate-archive: use each row's rate at Timestamp + horizon (e.g. 1D) instead of one rate per pair")
+    p.add_argument("--backtest-horizons", help="With --rate-archive: also evaluate every row at these forward horizons, e.g. 1D,7D,30D")
+    p.add_argument("--save-sketch", action="store_true", help="Write mergeable error-distribution sketches to <file>.sketch.json")
+    p.add_argument("--save-cube", action="store_true", help="Write the (Pair, Decision, Day) aggregation cube to <file>.cube.csv")
+    p.add_argument("--rolling-window", help="Time-based rolling window per pair, e.g. 7D or 30D (writes daily values to <file>.rolling.csv)")
+    p.add_argument("--sweep", type=float, metavar="PCT", help="What-if sweep of the actual rate over +/- PCT percent (writes <file>.sweep.csv)")
+    p.add_argument("--sweep-steps", type=int, default=DEFAULT_SWEEP_STEPS, help="Number of candidate rates in the --sweep grid")
+    p.add_argument("--workers", type=int, default=1, help="Evaluate and summarise on this many processes (0 = all cores); for very large logs")
     args = p.parse_args()
+    if args.backtest_horizons and not args.rate_archive:
+        p.error("--backtest-horizons needs --rate-archive")
 
     for path in args.file:
         print(f"Processing: {path}")
         df = _read_csv(path)
 
+        validation = validate_rows(df, filename=path)
+        if len(validation.rejected):
+            rejected_path = path.replace(".csv", ".rejected.csv")
+            _write_csv(validation.rejected, rejected_path)
+            print(f"Rejected {len(validation.rejected)} rows {validation.counts}; saved to {rejected_path}", file=sys.stderr)
+        df = validation.clean
+        if df.empty:
+            print(f"No valid rows in {path}; skipping", file=sys.stderr)
+            continue
+
         actual = args.actual
-        if actual is None and args.infer_pair:
-            pair = infer_pair_from_df_or_filename(df, path)
+        as_of = yesterday_eod() if args.as_of_yesterday else None
+
+        row_pairs = parse_row_pairs(df) if actual is None and args.infer_pair else None
+        file_pairs = unique_pairs(row_pairs) if row_pairs is not None else []
+        if actual is None and args.rate_archive:
+            actual = RateArchive(args.rate_archive).rates_for_frame(df, as_of=as_of, horizon=args.archive_horizon, filename=path)
+            if actual.isna().all():
+                print(f"Rate archive has no rates for {path}; skipping", file=sys.stderr)
+                continue
+        elif len(file_pairs) > 1:
+            # mixed-pair file: fetch every distinct pair concurrently, evaluate each row against its own pair
+            fetched = fetch_actual_rates(file_pairs, as_of=as_of, max_staleness=args.max_staleness)
+            failed = [f"{b}/{q}" for (b, q), r in fetched.items() if r is None]
+            if failed:
+                print(f"Rate fetch returned no value for {', '.join(failed)}; skipping {path}", file=sys.stderr)
+                continue
+            rates_used = {f"{b}/{q}": r for (b, q), r in fetched.items()}
+            print("Rates used:", rates_used)
+            actual = row_pairs.map(rates_used)
+            if "Pair" not in df.columns:
+                df["Pair"] = row_pairs
+        elif actual is None and args.infer_pair:
+            try:
+                pair = infer_pair_from_df_or_filename(df, path)
+            except RuntimeError:
+                pair = None
             if pair is None:
                 print(f"Could not infer pair for {path}; skipping. Provide --actual or add Pair column.", file=sys.stderr)
                 continue
             base, quote = pair
-            as_of = None
-            if args.as_of_yesterday:
-                as_of = (datetime.utcnow() - timedelta(days=1)).replace(hour=23, minute=59, second=0, microsecond=0)
             try:
-                actual = fetch_actual_rate(base, quote, as_of=as_of)
+                actual, age = fetch_rate_with_age(base, quote, as_of=as_of, max_staleness=args.max_staleness)
+                if age:
+                    print(f"Using cached {base}/{quote} rate {actual} ({age:.0f}s old)")
             except Exception as e:
                 print(f"Rate fetch failed for {base}/{quote}: {e}", file=sys.stderr)
                 continue
@@ -66,15 +120,78 @@ def main():
             print("Pass --actual <rate> or use --infer-pair to fetch a rate automatically.", file=sys.stderr)
             continue
 
-        audited = evaluate_dataframe(df, actual_rate=actual, fill_missing_only=True)
-        summary = compute_summary(audited, by_pair=True)
+        horizons, default_pair = [], None
+        if args.backtest_horizons:
+            try:
+                default_pair = "/".join(infer_pair_from_df_or_filename(pd.DataFrame(), path))
+            except RuntimeError:
+                default_pair = None
+            horizons = [h.strip() for h in args.backtest_horizons.split(",") if h.strip()]
+            try:
+                pd.to_timedelta(horizons)
+            except ValueError as e:
+                print(f"Invalid backtest horizons {args.backtest_horizons!r}: {e}", file=sys.stderr)
+                continue
+
+        if args.workers != 1:
+            # row partitions evaluated and summarised on a process pool (shared-memory buffers)
+            audited, summary = audit_partitioned(df, actual, workers=args.workers or None, rate_archive=args.rate_archive,
+                                                 horizons=horizons, default_pair=default_pair,
+                                                 include_sketch=args.save_sketch)
+        else:
+            audited = evaluate_dataframe(df, actual_rate=actual, fill_missing_only=True)
+            if horizons:
+                audited = evaluate_horizons(audited, RateArchive(args.rate_archive).histories(), horizons, default_pair=default_pair)
+            summary = compute_summary(audited, by_pair=True, include_sketch=args.save_sketch)
         out_path = path.replace(".csv", ".audited.csv")
         _write_csv(audited, out_path)
 
+        if args.save_sketch:
+            sketches = {"ALL": summary.pop("error_sketch")}
+            for pair, pair_summary in summary.get("by_pair", {}).items():
+                sketches[pair] = pair_summary.pop("error_sketch")
+            sketch_path = path.replace(".csv", ".sketch.json")
+            with open(sketch_path, "w") as fh:
+                json.dump(sketches, fh)
+            print("Saved error sketches to", sketch_path)
+
+        cube = build_cube(audited) if args.save_cube or args.rolling_window else None
+        if args.save_cube:
+            cube_path = path.replace(".csv", ".cube.csv")
+            _write_csv(cube, cube_path)
+            print("Saved aggregation cube to", cube_path)
+
         # print concise human-friendly summary
         print("Summary:", summary)
+        if summary.get("models"):
+            print("Model comparison:")
+            print(pd.DataFrame(summary["models"]).T.to_string())
         print("Saved audited CSV to", out_path)
 
+        if args.rolling_window:
+            try:
+                rolling = rolling_from_cube(cube, window=args.rolling_window)
+            except ValueError as e:
+                print(f"Invalid rolling window {args.rolling_window!r}: {e}", file=sys.stderr)
+                continue
+            rolling_path = path.replace(".csv", ".rolling.csv")
+            _write_csv(rolling, rolling_path)
+            print(f"Rolling {args.rolling_window} (latest per pair):")
+            print(rolling.groupby("Pair").tail(1).to_string(index=False))
+            print("Saved rolling metrics to", rolling_path)
+
+        if args.sweep:
+            try:
+                curve = sweep_actual_rates(df, actual, pct=args.sweep, steps=args.sweep_steps)
+            except ValueError as e:
+                print(f"Invalid sweep: {e}", file=sys.stderr)
+                continue
+            sweep_path = path.replace(".csv", ".sweep.csv")
+            _write_csv(curve, sweep_path)
+            print(f"What-if sweep (+/-{args.sweep}% in {args.sweep_steps} steps):")
+            print(curve.to_string(index=False))
+            print("Saved sweep curve to", sweep_path)
+
 if __name__ == "__main__":
     main()
 
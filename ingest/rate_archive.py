@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Local historical rate archive.
+
+Rate history files (CSV with a timestamp, a pair and a rate column) are imported into
+per-pair, time-sorted NumPy arrays on disk:
+
+    <archive_dir>/NZD_USD.ts.npy     int64 nanoseconds since epoch (UTC)
+    <archive_dir>/NZD_USD.rate.npy   float64 rates
+
+Lookups open them with mmap_mode="r" and resolve timestamps with np.searchsorted,
+so only the pages touched by the binary search are read from disk.
+
+Usage:
+  python -m ingest.rate_archive --archive rates/ history_2019.csv history_2020.csv
+"""
+
+import argparse
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from audit.timestamps import detect_format, parse_timestamps, to_utc_ns, NAT_NS
+from validators import parse_row_pairs, unique_pairs, infer_pair_from_df_or_filename
+
+ARCHIVE_PATH = os.getenv("RATE_ARCHIVE_PATH", "rate_archive")
+IMPORT_CHUNK_ROWS = 1_000_000
+
+
+def _pair_stem(base: str, quote: str) -> str:
+    return f"{base.upper().strip()}_{quote.upper().strip()}"
+
+
+def _save_atomic(path: str, arr: np.ndarray) -> None:
+    tmp = path + ".tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def import_rate_history(
+    paths: Iterable[str],
+    archive_dir: str = ARCHIVE_PATH,
+    ts_col: str = "Timestamp",
+    rate_col: str = "Rate",
+    chunk_rows: int = IMPORT_CHUNK_ROWS,
+) -> Dict[str, int]:
+    """
+    Import rate history CSVs into the archive, merging with what is already there.
+    Pairs come from a Pair column or Base/Quote columns. Duplicate timestamps keep the
+    last imported rate. Returns the number of points stored per pair.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+
+    for path in paths:
+        fmt = None
+        for i, chunk in enumerate(pd.read_csv(path, chunksize=chunk_rows)):
+            if i == 0:
+                # one format per file, so ambiguous dates (05/01/2024) read the same way in every chunk
+                fmt = detect_format(chunk[ts_col])
+            keys = parse_row_pairs(chunk)
+            ts = to_utc_ns(chunk[ts_col], fmt=fmt)
+            rate = pd.to_numeric(chunk[rate_col], errors="coerce").to_numpy(dtype=np.float64)
+            ok = np.flatnonzero(keys.notna().to_numpy() & (ts != NAT_NS) & ~np.isnan(rate))
+            for key, rows in pd.Series(ok).groupby(keys.to_numpy()[ok]):
+                rows = rows.to_numpy()
+                parts.setdefault(key.replace("/", "_"), []).append((ts[rows], rate[rows]))
+
+    archive = RateArchive(archive_dir)
+    counts = {}
+    for stem, chunks in parts.items():
+        existing = archive._arrays(stem)
+        if existing is not None:
+            chunks = [(np.asarray(existing[0]), np.asarray(existing[1]))] + chunks
+        ts = np.concatenate([c[0] for c in chunks])
+        rate = np.concatenate([c[1] for c in chunks])
+        order = np.argsort(ts, kind="stable")
+        ts, rate = ts[order], rate[order]
+        # keep the last rate written for each timestamp
+        last = np.append(ts[1:] != ts[:-1], True)
+        ts, rate = ts[last], rate[last]
+
+        archive._close(stem)
+        _save_atomic(os.path.join(archive_dir, f"{stem}.ts.npy"), ts)
+        _save_atomic(os.path.join(archive_dir, f"{stem}.rate.npy"), rate)
+        counts[stem.replace("_", "/")] = int(len(ts))
+    return counts
+
+
+class RateArchive:
+    """Read-only, memory-mapped view over an archive directory."""
+
+    def __init__(self, archive_dir: str = ARCHIVE_PATH):
+        self.archive_dir = archive_dir
+        self._maps: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        if not os.path.isdir(self.archive_dir):
+            return []
+        stems = sorted(f[: -len(".ts.npy")] for f in os.listdir(self.archive_dir) if f.endswith(".ts.npy"))
+        return [tuple(s.split("_")) for s in stems]
+
+    def _arrays(self, stem: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if stem not in self._maps:
+            ts_path = os.path.join(self.archive_dir, f"{stem}.ts.npy")
+            rate_path = os.path.join(self.archive_dir, f"{stem}.rate.npy")
+            if not (os.path.exists(ts_path) and os.path.exists(rate_path)):
+                return None
+            self._maps[stem] = (np.load(ts_path, mmap_mode="r"), np.load(rate_path, mmap_mode="r"))
+        return self._maps[stem]
+
+    def _close(self, stem: str) -> None:
+        self._maps.pop(stem, None)
+
+    def histories(self, pairs: Optional[Iterable[Tuple[str, str]]] = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Memory-mapped (timestamps ns, rates) per 'BASE/QUOTE' key (all archived pairs by default),
+        the history format audit.evaluator.evaluate_horizons takes."""
+        out = {}
+        for base, quote in (self.pairs() if pairs is None else pairs):
+            arrays = self._arrays(_pair_stem(base, quote))
+            if arrays is not None:
+                out[f"{base.upper()}/{quote.upper()}"] = arrays
+        return out
+
+    def lookup(self, base: str, quote: str, timestamps, tolerance: Optional[str] = None) -> np.ndarray:
+        """
+        Rate in force at each timestamp (last archived point at or before it).
+        NaN where the pair is unknown, the timestamp precedes the history, or the
+        nearest point is older than tolerance (a pandas offset like "3D").
+        """
+        q = to_utc_ns(timestamps)
+        out = np.full(len(q), np.nan)
+        arrays = self._arrays(_pair_stem(base, quote))
+        if arrays is None or len(arrays[0]) == 0:
+            return out
+        ts, rates = arrays
+
+        idx = np.searchsorted(ts, q, side="right") - 1
+        valid = (idx >= 0) & (q != NAT_NS)
+        if tolerance is not None:
+            valid &= (q - ts[np.clip(idx, 0, None)]) <= pd.Timedelta(tolerance).value
+        out[valid] = rates[idx[valid]]
+        return out
+
+    def rate_at(self, base: str, quote: str, as_of=None) -> Optional[float]:
+        """Single rate as of a point in time (latest archived point when as_of is None)."""
+        arrays = self._arrays(_pair_stem(base, quote))
+        if arrays is None or len(arrays[0]) == 0:
+            return None
+        if as_of is None:
+            return float(arrays[1][-1])
+        val = self.lookup(base, quote, [as_of])[0]
+        return None if np.isnan(val) else float(val)
+
+    def lookup_rows(self, pair_keys: pd.Series, timestamps: pd.Series, tolerance: Optional[str] = None) -> pd.Series:
+        """Per-row rates for a frame: pair_keys like 'NZD/USD' (see validators.parse_row_pairs)."""
+        out = np.full(len(pair_keys), np.nan)
+        ts = np.asarray(timestamps)
+        for key, rows in pd.Series(np.arange(len(pair_keys))).groupby(pair_keys.to_numpy()):
+            base, quote = key.split("/")
+            rows = rows.to_numpy()
+            out[rows] = self.lookup(base, quote, ts[rows], tolerance=tolerance)
+        return pd.Series(out, index=pair_keys.index)
+
+    def rates_for_frame(self, df: pd.DataFrame, as_of=None, horizon: Optional[str] = None,
+                        filename: Optional[str] = None, ts_col: str = "Timestamp") -> pd.Series:
+        """
+        Offline per-row actual rates for a hedge log.
+        - horizon None: each pair's rate as of as_of (latest archived point when as_of is None),
+          i.e. a drop-in for the live provider.
+        - horizon given (e.g. "1D"): each row's rate at its own Timestamp + horizon.
+        Rows whose pair cannot be determined fall back to the pair inferred from the filename.
+        """
+        keys = parse_row_pairs(df)
+        if keys.isna().any() and filename:
+            try:
+                fallback = "/".join(infer_pair_from_df_or_filename(pd.DataFrame(), filename))
+                keys = keys.fillna(fallback)
+            except RuntimeError:
+                pass
+
+        if horizon:
+            ts = parse_timestamps(df[ts_col]) + pd.Timedelta(horizon)
+            return self.lookup_rows(keys, ts)
+        rates = {f"{b}/{q}": self.rate_at(b, q, as_of) for b, q in unique_pairs(keys)}
+        return keys.map(rates).astype(float)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Import local FX rate history into the memory-mapped archive")
+    p.add_argument("files", nargs="+", help="Rate history CSV(s) with timestamp, pair (or Base/Quote) and rate columns")
+    p.add_argument("--archive", default=ARCHIVE_PATH, help="Archive directory (default: RATE_ARCHIVE_PATH or ./rate_archive)")
+    p.add_argument("--ts-col", default="Timestamp", help="Timestamp column name")
+    p.add_argument("--rate-col", default="Rate", help="Rate column name")
+    args = p.parse_args()
+
+    counts = import_rate_history(args.files, args.archive, ts_col=args.ts_col, rate_col=args.rate_col)
+    for pair, n in sorted(counts.items()):
+        print(f"{pair}: {n} points")
+    print("Archive written to", args.archive)
+
+
+if __name__ == "__main__":
+    main()
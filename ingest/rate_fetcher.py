@@ -6,9 +6,14 @@ Created on Mon Sep 29 13:06:32 2025
 """
 
 # ingest/rate_fetcher.py
+import heapq
+import itertools
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Iterable, Optional, Tuple
 import requests
 import shelve
 import os
@@ -16,11 +21,191 @@ import math
 
 # Configuration
 DEFAULT_PROVIDER = "https://api.exchangerate.host"
+# ExchangeRate-API base URL; point elsewhere (e.g. loadtest.py's mock provider) with FX_PROVIDER_URL
+PROVIDER_URL = os.getenv("FX_PROVIDER_URL", "https://v6.exchangerate-api.com/v6")
 CACHE_PATH = os.getenv("RATE_CACHE_PATH", ".rate_cache.db")
-CACHE_TTL_SECONDS = int(os.getenv("RATE_CACHE_TTL_SECONDS", str(60 * 60 * 24)))  # default 24h
 REQUEST_TIMEOUT = 8  # seconds
 MAX_RETRIES = 3
 RETRY_BACKOFF = 1.5  # multiplier
+MAX_CONCURRENT_FETCHES = int(os.getenv("RATE_MAX_CONCURRENT_FETCHES", "8"))
+# stale-while-revalidate: serve cached rates up to this age (0 = always hit the provider)
+MAX_STALENESS_SECONDS = float(os.getenv("RATE_MAX_STALENESS_SECONDS", "0"))
+# cached rates younger than this are served without triggering a background refresh
+FRESH_SECONDS = float(os.getenv("RATE_FRESH_SECONDS", "60"))
+
+# provider quota: token bucket refilled at RATE_QUOTA_PER_MINUTE with bursts up to RATE_QUOTA_BURST
+QUOTA_PER_MINUTE = float(os.getenv("RATE_QUOTA_PER_MINUTE", "60"))
+QUOTA_BURST = int(os.getenv("RATE_QUOTA_BURST", "10"))
+# same-base requests arriving within this window share one upstream call
+COALESCE_WINDOW_SECONDS = float(os.getenv("RATE_COALESCE_WINDOW_MS", "50")) / 1000.0
+# how long a caller waits for a queued request before giving up
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("RATE_QUEUE_TIMEOUT_SECONDS", "30"))
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_CACHE_LOCK = threading.Lock()
+_REFRESH_LOCK = threading.Lock()
+_REFRESHING = set()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available: returns 0.0 if taken, else the seconds until the next refill."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else 1.0
+
+
+class ProviderRequestScheduler:
+    """
+    Funnels every upstream call through one token bucket and a priority queue.
+    Requests for the same (provider, base) that are queued or in flight share a single
+    Future, and new entries wait COALESCE_WINDOW_SECONDS before dispatch so near-simultaneous
+    callers join them. A worker takes a token only once a request is ready to dispatch; while
+    the bucket is empty the request stays queued, so interactive audits arriving meanwhile
+    overtake background refreshes and idle workers never hold tokens.
+    """
+
+    def __init__(self, per_minute: float = QUOTA_PER_MINUTE, burst: int = QUOTA_BURST,
+                 coalesce_window: float = COALESCE_WINDOW_SECONDS, workers: int = MAX_CONCURRENT_FETCHES):
+        self.bucket = TokenBucket(per_minute, burst)
+        self.per_minute = per_minute
+        self.coalesce_window = coalesce_window
+        self.workers = max(1, workers)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._queued: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        # when each queued request was first ready but found the bucket empty
+        self._throttled_since: Dict[Tuple[str, str], float] = {}
+        self._seq = itertools.count()
+        self._threads = []
+        self._upstream_times = deque()
+        self._metrics = {"submitted": 0, "coalesced": 0, "upstream_requests": 0, "upstream_errors": 0,
+                         "throttle_wait_seconds": 0.0}
+
+    def _ensure_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, name=f"rate-provider-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def submit(self, provider: str, base: str, priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """Future resolving to the provider's conversion_rates dict for base."""
+        key = (provider, base)
+        with self._cond:
+            self._ensure_workers()
+            self._metrics["submitted"] += 1
+            fut = self._pending.get(key)
+            if fut is not None:
+                self._metrics["coalesced"] += 1
+                queued = self._queued.get(key)
+                if queued is not None and priority < queued[0]:
+                    # re-queue at the better priority; the old heap entry is skipped as stale
+                    self._push(key, priority, time.monotonic())
+                return fut
+            fut = Future()
+            self._pending[key] = fut
+            self._push(key, priority, time.monotonic() + self.coalesce_window)
+            return fut
+
+    def _push(self, key: Tuple[str, str], priority: int, ready_at: float) -> None:
+        seq = next(self._seq)
+        self._queued[key] = (priority, seq)
+        heapq.heappush(self._heap, (priority, ready_at, seq, key))
+        self._cond.notify()
+
+    def _next_ready(self) -> Tuple[str, str]:
+        """Best ready request, dequeued with a token taken for it (upstream call counted)."""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                priority, ready_at, seq, key = self._heap[0]
+                if self._queued.get(key, (None, None))[1] != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                delay = ready_at - now
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                delay = self.bucket.try_acquire()
+                if delay > 0:
+                    # quota exhausted: the request stays queued (a better one may overtake it) until the refill
+                    self._throttled_since.setdefault(key, now)
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._queued[key]
+                throttled = self._throttled_since.pop(key, None)
+                if throttled is not None:
+                    self._metrics["throttle_wait_seconds"] += now - throttled
+                self._metrics["upstream_requests"] += 1
+                self._upstream_times.append(time.time())
+                return key
+
+    def _work(self) -> None:
+        while True:
+            key = self._next_ready()
+            provider, base = key
+            try:
+                result, error = _provider_latest(provider, base), None
+            except Exception as e:
+                result, error = None, e
+            with self._cond:
+                fut = self._pending.pop(key)
+                if error is not None:
+                    self._metrics["upstream_errors"] += 1
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+    def metrics(self) -> Dict:
+        with self._cond:
+            cutoff = time.time() - 60
+            while self._upstream_times and self._upstream_times[0] < cutoff:
+                self._upstream_times.popleft()
+            out = dict(self._metrics)
+            out.update({
+                "quota_per_minute": self.per_minute,
+                "burst": self.bucket.capacity,
+                "upstream_last_60s": len(self._upstream_times),
+                "tokens_available": round(self.bucket.available(), 3),
+                "queued": len(self._queued),
+                "in_flight": len(self._pending) - len(self._queued),
+            })
+            return out
+
+
+_PROVIDER_SCHEDULER = ProviderRequestScheduler()
+
+
+def quota_metrics() -> Dict:
+    """Provider quota usage and scheduler queue state."""
+    return _PROVIDER_SCHEDULER.metrics()
 
 
 def _cache_key(base: str, quote: str, as_of_dt: Optional[datetime]) -> str:
@@ -28,40 +213,54 @@ def _cache_key(base: str, quote: str, as_of_dt: Optional[datetime]) -> str:
     return f"{base.upper()}_{quote.upper()}_{date_key}"
 
 
-def _read_cache(key: str) -> Optional[float]:
+def _read_cache_entry(key: str) -> Optional[Tuple[float, float]]:
+    """Return (value, written_at) for a cache key regardless of TTL, or None."""
     try:
-        with shelve.open(CACHE_PATH) as db:
+        with _CACHE_LOCK, shelve.open(CACHE_PATH) as db:
             entry = db.get(key)
             if not entry:
                 return None
             ts, val = entry.get("ts"), entry.get("val")
             if ts is None or val is None:
                 return None
-            if (time.time() - ts) > CACHE_TTL_SECONDS:
-                return None
-            return float(val)
+            return float(val), float(ts)
     except Exception:
         return None
 
 
 def _write_cache(key: str, value: float) -> None:
     try:
-        with shelve.open(CACHE_PATH) as db:
+        with _CACHE_LOCK, shelve.open(CACHE_PATH) as db:
             db[key] = {"ts": time.time(), "val": float(value)}
     except Exception:
         # swallow cache failures; caching is best-effort
         pass
 
 
-def fetch_actual_rate(
-    base: str,
-    quote: str,
-    as_of: Optional[datetime] = None,
-    provider: str = "https://v6.exchangerate-api.com/v6",
-    as_of_yesterday: bool = False,
-) -> Optional[float]:
-    base = base.upper().strip()
-    quote = quote.upper().strip()
+def yesterday_eod(now: Optional[datetime] = None) -> datetime:
+    """Yesterday 23:59 UTC (naive), the as-of point used for 'yesterday' audits."""
+    now = now or datetime.utcnow()
+    return (now - timedelta(days=1)).replace(hour=23, minute=59, second=0, microsecond=0)
+
+
+def write_snapshot(base: str, quote: str, as_of_dt: datetime, value: float) -> None:
+    """Persist a rate under an as-of key so later as-of requests are served locally."""
+    _write_cache(_cache_key(base.upper().strip(), quote.upper().strip(), as_of_dt), value)
+
+
+def _provider_latest(provider: str, base: str) -> Dict[str, float]:
+    """One upstream call: all conversion rates for base. Raises on failure."""
+    api_key = os.getenv("FX_API_KEY")
+    url = f"{provider}/{api_key}/latest/{base}"
+    print(f"[FETCH] {url}")
+    resp = requests.get(url, timeout=REQUEST_TIMEOUT)
+    print(f"[RESPONSE] Status: {resp.status_code}")
+    print(f"[RESPONSE] Body: {resp.text}")
+    resp.raise_for_status()
+    return resp.json().get("conversion_rates", {})
+
+
+def _fetch_from_provider(base: str, quote: str, provider: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[float]:
     api_key = os.getenv("FX_API_KEY")
     print(f"[DEBUG] Loaded FX_API_KEY: {api_key}")
 
@@ -70,19 +269,9 @@ def fetch_actual_rate(
         print("[ERROR] FX_API_KEY not found in environment.")
         return None
 
-    if as_of_yesterday:
-        print("[WARNING] ExchangeRate-API does not support historical rates. Using latest instead.")
-
-    url = f"{provider}/{api_key}/latest/{base}"
-    print(f"[FETCH] {url} → looking for {quote}")
-
     try:
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-        print(f"[RESPONSE] Status: {resp.status_code}")
-        print(f"[RESPONSE] Body: {resp.text}")
-        resp.raise_for_status()
-        data = resp.json()
-        rate = data.get("conversion_rates", {}).get(quote)
+        rates = _PROVIDER_SCHEDULER.submit(provider, base, priority).result(timeout=QUEUE_TIMEOUT_SECONDS)
+        rate = rates.get(quote)
         if rate is not None:
             rate = float(rate)
             _write_cache(_cache_key(base, quote, None), rate)
@@ -91,8 +280,129 @@ def fetch_actual_rate(
         print(f"[ERROR] No rate found for {base}/{quote}")
         return None
     except Exception as e:
-        print(f"[FAILURE] Error fetching rate: {e}")
+        print(f"[FAILURE] Error fetching rate: {e!r}")
         return None
 
 
+def _refresh_in_background(base: str, quote: str, provider: str) -> None:
+    """Start at most one background provider refresh per pair."""
+    key = _cache_key(base, quote, None)
+    with _REFRESH_LOCK:
+        if key in _REFRESHING:
+            return
+        _REFRESHING.add(key)
+
+    def _run():
+        try:
+            _fetch_from_provider(base, quote, provider, priority=PRIORITY_BACKGROUND)
+        finally:
+            with _REFRESH_LOCK:
+                _REFRESHING.discard(key)
+
+    threading.Thread(target=_run, name=f"rate-refresh-{key}", daemon=True).start()
+
+
+def fetch_rate_with_age(
+    base: str,
+    quote: str,
+    as_of: Optional[datetime] = None,
+    provider: str = PROVIDER_URL,
+    as_of_yesterday: bool = False,
+    max_staleness: Optional[float] = None,
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Return (rate, age_seconds).
+
+    With max_staleness (seconds, default RATE_MAX_STALENESS_SECONDS; 0 disables) a cached
+    rate no older than the bound is served immediately. If it is older than
+    RATE_FRESH_SECONDS a background refresh updates the cache for the next caller, so the
+    provider's latency stays off the request path. Otherwise the provider is called
+    synchronously and the age is 0. If the provider fails, the last cached rate is served
+    with its real age, however old; (None, None) only when nothing was ever cached.
+    """
+    base = base.upper().strip()
+    quote = quote.upper().strip()
+    if max_staleness is None:
+        max_staleness = MAX_STALENESS_SECONDS
+
+    if as_of_yesterday and as_of is None:
+        as_of = yesterday_eod()
+    if as_of is not None:
+        # end-of-day snapshots are written by ingest.rate_scheduler at 23:59 UTC
+        entry = _read_cache_entry(_cache_key(base, quote, as_of))
+        if entry is not None:
+            print(f"[SNAPSHOT] {base}/{quote} as of {as_of:%Y-%m-%d %H:%M} → {entry[0]}")
+            return entry[0], max(0.0, time.time() - entry[1])
+        print(f"[WARNING] No snapshot for {base}/{quote} as of {as_of:%Y-%m-%d %H:%M} and ExchangeRate-API "
+              "does not support historical rates. Using latest instead.")
+
+    if max_staleness > 0:
+        entry = _read_cache_entry(_cache_key(base, quote, None))
+        if entry is not None:
+            rate, written_at = entry
+            age = max(0.0, time.time() - written_at)
+            if age <= max_staleness:
+                if age > FRESH_SECONDS:
+                    _refresh_in_background(base, quote, provider)
+                print(f"[CACHE] {base}/{quote} → {rate} (age {age:.0f}s)")
+                return rate, age
+
+    rate = _fetch_from_provider(base, quote, provider)
+    if rate is not None:
+        return rate, 0.0
+    entry = _read_cache_entry(_cache_key(base, quote, None))
+    if entry is not None:
+        rate, written_at = entry
+        age = max(0.0, time.time() - written_at)
+        print(f"[CACHE] provider failed; serving last cached {base}/{quote} → {rate} (age {age:.0f}s)")
+        return rate, age
+    return None, None
 
+
+def fetch_actual_rate(
+    base: str,
+    quote: str,
+    as_of: Optional[datetime] = None,
+    provider: str = PROVIDER_URL,
+    as_of_yesterday: bool = False,
+    max_staleness: Optional[float] = None,
+) -> Optional[float]:
+    return fetch_rate_with_age(base, quote, as_of=as_of, provider=provider,
+                               as_of_yesterday=as_of_yesterday, max_staleness=max_staleness)[0]
+
+
+def fetch_rates_with_age(
+    pairs: Iterable[Tuple[str, str]],
+    as_of: Optional[datetime] = None,
+    as_of_yesterday: bool = False,
+    max_workers: int = MAX_CONCURRENT_FETCHES,
+    max_staleness: Optional[float] = None,
+) -> Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]]:
+    """Fetch several pairs concurrently; failed pairs map to (None, None)."""
+    pairs = list(dict.fromkeys((b.upper().strip(), q.upper().strip()) for b, q in pairs))
+    if not pairs:
+        return {}
+
+    def _one(pair: Tuple[str, str]) -> Tuple[Optional[float], Optional[float]]:
+        try:
+            return fetch_rate_with_age(pair[0], pair[1], as_of=as_of, as_of_yesterday=as_of_yesterday,
+                                       max_staleness=max_staleness)
+        except Exception as e:
+            print(f"[FAILURE] Error fetching rate for {pair[0]}/{pair[1]}: {e}")
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs)))) as pool:
+        return dict(zip(pairs, pool.map(_one, pairs)))
+
+
+def fetch_actual_rates(
+    pairs: Iterable[Tuple[str, str]],
+    as_of: Optional[datetime] = None,
+    as_of_yesterday: bool = False,
+    max_workers: int = MAX_CONCURRENT_FETCHES,
+    max_staleness: Optional[float] = None,
+) -> Dict[Tuple[str, str], Optional[float]]:
+    """Fetch several pairs concurrently; failed pairs map to None."""
+    fetched = fetch_rates_with_age(pairs, as_of=as_of, as_of_yesterday=as_of_yesterday,
+                                   max_workers=max_workers, max_staleness=max_staleness)
+    return {pair: rate for pair, (rate, _age) in fetched.items()}
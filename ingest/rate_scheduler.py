@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+In-process rate pre-warming and end-of-day snapshots.
+
+RateScheduler runs on a daemon thread:
+  - on start it warms the cache for the configured pairs,
+  - every RATE_PREWARM_INTERVAL_SECONDS it refreshes them again,
+  - at 23:59 UTC it stores each pair's rate as that day's end-of-day snapshot,
+    which fetch_actual_rate serves for as_of / as_of_yesterday requests.
+
+Configure with RATE_PREWARM_PAIRS="NZD/USD,EUR/USD"; the scheduler is a no-op without pairs.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ingest.rate_fetcher import _fetch_from_provider, write_snapshot, MAX_CONCURRENT_FETCHES, PRIORITY_BACKGROUND, PROVIDER_URL
+from validators import _parse_pair_string
+
+PREWARM_PAIRS = os.getenv("RATE_PREWARM_PAIRS", "")
+PREWARM_INTERVAL_SECONDS = float(os.getenv("RATE_PREWARM_INTERVAL_SECONDS", str(15 * 60)))
+PROVIDER = PROVIDER_URL
+
+
+def parse_pair_list(text: str) -> List[Tuple[str, str]]:
+    """'NZD/USD, eurusd' -> [('NZD', 'USD'), ('EUR', 'USD')]; unparseable entries are skipped."""
+    pairs = []
+    for item in (text or "").split(","):
+        parsed = _parse_pair_string(item.strip()) if item.strip() else None
+        if parsed and parsed not in pairs:
+            pairs.append(parsed)
+    return pairs
+
+
+def _next_eod(now: datetime) -> datetime:
+    eod = now.replace(hour=23, minute=59, second=0, microsecond=0)
+    return eod if eod > now else eod + timedelta(days=1)
+
+
+class RateScheduler:
+    def __init__(self, pairs: Iterable[Tuple[str, str]], interval_seconds: float = PREWARM_INTERVAL_SECONDS,
+                 provider: str = PROVIDER):
+        self.pairs = list(pairs)
+        self.interval_seconds = float(interval_seconds)
+        self.provider = provider
+        self.last_prewarm: Optional[float] = None
+        self.last_snapshot: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def prewarm(self) -> Dict[Tuple[str, str], Optional[float]]:
+        """Fetch every configured pair now (fills the 'latest' cache)."""
+        if not self.pairs:
+            return {}
+        workers = max(1, min(MAX_CONCURRENT_FETCHES, len(self.pairs)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rates = dict(zip(self.pairs, pool.map(lambda p: _fetch_from_provider(p[0], p[1], self.provider, PRIORITY_BACKGROUND), self.pairs)))
+        self.last_prewarm = time.time()
+        return rates
+
+    def snapshot(self, as_of_dt: datetime) -> Dict[Tuple[str, str], Optional[float]]:
+        """Store the current rate of every configured pair under the as-of key."""
+        rates = self.prewarm()
+        for (base, quote), rate in rates.items():
+            if rate is not None:
+                write_snapshot(base, quote, as_of_dt, rate)
+            else:
+                print(f"[SNAPSHOT] No rate for {base}/{quote}; {as_of_dt:%Y-%m-%d} snapshot missing")
+        self.last_snapshot = as_of_dt
+        return rates
+
+    def _run(self) -> None:
+        self.prewarm()
+        next_prewarm = time.time() + self.interval_seconds
+        next_eod = _next_eod(datetime.utcnow())
+        while not self._stop.is_set():
+            wait = min(next_prewarm - time.time(), (next_eod - datetime.utcnow()).total_seconds())
+            if self._stop.wait(max(0.0, wait)):
+                break
+            try:
+                if datetime.utcnow() >= next_eod:
+                    self.snapshot(next_eod)
+                    next_eod = _next_eod(datetime.utcnow() + timedelta(minutes=1))
+                    next_prewarm = time.time() + self.interval_seconds
+                elif time.time() >= next_prewarm:
+                    self.prewarm()
+                    next_prewarm = time.time() + self.interval_seconds
+            except Exception as e:
+                # keep the scheduler alive; the next tick retries
+                print(f"[SCHEDULER] {e}")
+
+    def start(self) -> "RateScheduler":
+        if self.pairs and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rate-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> Dict:
+        return {
+            "pairs": [f"{b}/{q}" for b, q in self.pairs],
+            "interval_seconds": self.interval_seconds,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "last_prewarm": datetime.utcfromtimestamp(self.last_prewarm).isoformat() if self.last_prewarm else None,
+            "last_snapshot": self.last_snapshot.isoformat() if self.last_snapshot else None,
+        }
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the /audit service.
+
+Starts a local stand-in for the exchange-rate provider (with latency and failure
+injection), launches api_app under uvicorn pointed at it via FX_PROVIDER_URL, then drives
+concurrent uploads of generated hedge logs at each requested size. Reports requests per
+second, latency percentiles, peak memory per worker process and the latency of a cheap
+probe endpoint sampled during the run: a probe that slows down with load means request
+handling is blocking the event loop.
+
+Usage examples:
+  python loadtest.py --sizes 1000,10000,100000 --concurrency 8 --requests 40
+  python loadtest.py --workers 4 --provider-latency-ms 300 --provider-failure-rate 0.05
+  python loadtest.py --url http://127.0.0.1:8000 --sizes 50000   # against a running service
+
+Launching the service needs uvicorn; per-worker memory is read from /proc (Linux).
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+
+# units of each currency per 1 USD; mock cross rates are derived from these
+RATES_PER_USD = {"USD": 1.0, "NZD": 1.64, "AUD": 1.52, "EUR": 0.92, "GBP": 0.79, "JPY": 150.0, "CAD": 1.36, "CHF": 0.88}
+PROBE_PATH = "/rates/quota"
+PROBE_INTERVAL_SECONDS = 0.1
+MEMORY_INTERVAL_SECONDS = 0.2
+
+
+class MockProvider:
+    """ExchangeRate-API look-alike serving GET /<key>/latest/<BASE> on localhost."""
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0, failure_rate: float = 0.0,
+                 port: int = 0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _handler(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with provider._lock:
+                    provider.calls += 1
+                    delay = max(0.0, provider._rng.gauss(provider.latency_ms, provider.jitter_ms)) / 1000.0
+                    fail = provider._rng.random() < provider.failure_rate
+                    if fail:
+                        provider.failures += 1
+                time.sleep(delay)
+
+                parts = self.path.strip("/").split("/")
+                base = parts[-1].upper() if len(parts) >= 3 and parts[-2] == "latest" else None
+                if fail or base not in RATES_PER_USD:
+                    status, body = (500, {"result": "error", "error-type": "injected-failure"}) if fail else \
+                                   (404, {"result": "error", "error-type": "unsupported-code"})
+                else:
+                    per_base = RATES_PER_USD[base]
+                    status, body = 200, {
+                        "result": "success",
+                        "base_code": base,
+                        "conversion_rates": {c: round(v / per_base, 6) for c, v in RATES_PER_USD.items()},
+                    }
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "MockProvider":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-provider", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def generate_hedge_log(rows: int, pairs: List[str], seed: int = 0) -> bytes:
+    """A synthetic hedge log CSV (Timestamp, Predicted_Rate, Live_Rate, Decision, Pair, Notional)."""
+    rng = np.random.default_rng(seed)
+    pair = rng.choice(pairs, rows)
+    mids = {p: RATES_PER_USD[p.split("/")[1]] / RATES_PER_USD[p.split("/")[0]] for p in pairs}
+    mid = pd.Series(pair).map(mids).to_numpy()
+    live = mid * (1 + rng.normal(0, 0.005, rows))
+    df = pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=rows, freq="min").strftime("%Y-%m-%d %H:%M:%S"),
+        "Predicted_Rate": np.round(live * (1 + rng.normal(0, 0.003, rows)), 6),
+        "Live_Rate": np.round(live, 6),
+        "Decision": rng.choice(["Hedge now", "Wait"], rows),
+        "Pair": pair,
+        "Notional": rng.integers(10_000, 1_000_000, rows),
+    })
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    return buf.getvalue().encode()
+
+
+def _children(pid: int) -> List[int]:
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as fh:
+                out.extend(int(c) for c in fh.read().split())
+    except OSError:
+        pass
+    return out
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        todo.extend(_children(p))
+    return pids
+
+
+def _is_helper(pid: int) -> bool:
+    """multiprocessing's resource tracker shows up next to uvicorn workers; it is not a worker."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as fh:
+            return b"resource_tracker" in fh.read()
+    except OSError:
+        return False
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class _Sampler(threading.Thread):
+    """Calls fn every interval seconds on a daemon thread until stopped."""
+
+    def __init__(self, fn, interval: float):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.fn()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    arr = np.asarray(latencies) * 1000.0
+    p50, p90, p99 = np.percentile(arr, [50, 90, 99])
+    return {"p50_ms": round(float(p50), 1), "p90_ms": round(float(p90), 1),
+            "p99_ms": round(float(p99), 1), "max_ms": round(float(arr.max()), 1)}
+
+
+def start_service(port: int, workers: int, provider_url: str, env: Dict[str, str],
+                  startup_timeout: float = 60.0) -> subprocess.Popen:
+    """Run api_app under uvicorn and wait until it answers."""
+    child_env = dict(os.environ, FX_PROVIDER_URL=provider_url, FX_API_KEY="loadtest", **env)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=child_env,
+    )
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {proc.returncode} (is uvicorn installed?)")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}{PROBE_PATH}", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"Service did not start within {startup_timeout:.0f}s")
+
+
+def run_size(url: str, payload: bytes, filename: str, n_requests: int, concurrency: int,
+             form: Dict[str, str], server_pid: Optional[int] = None, timeout: float = 300.0) -> Dict:
+    """Send n_requests uploads of payload with the given concurrency; returns the metrics for this size."""
+    latencies, statuses = [], {}
+    probe_latencies = []
+    peak_rss: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def _upload(_i):
+        start = time.perf_counter()
+        try:
+            resp = requests.post(f"{url}/audit", files={"file": (filename, payload, "text/csv")}, data=form, timeout=timeout)
+            status = resp.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    def _probe():
+        start = time.perf_counter()
+        try:
+            requests.get(f"{url}{PROBE_PATH}", timeout=timeout)
+            probe_latencies.append(time.perf_counter() - start)
+        except requests.RequestException:
+            pass
+
+    def _memory():
+        for pid in _process_tree(server_pid):
+            rss = _rss_bytes(pid)
+            if rss is not None and rss > peak_rss.get(pid, 0):
+                peak_rss[pid] = rss
+
+    samplers = [_Sampler(_probe, PROBE_INTERVAL_SECONDS)]
+    if server_pid is not None:
+        samplers.append(_Sampler(_memory, MEMORY_INTERVAL_SECONDS))
+    for s in samplers:
+        s.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_upload, range(n_requests)))
+    wall = time.perf_counter() - started
+    for s in samplers:
+        s.stop()
+
+    # with several uvicorn workers the first pid is the supervisor; report the workers
+    worker_rss = [peak_rss[p] for p in _process_tree(server_pid)[1:] if p in peak_rss and not _is_helper(p)] if server_pid else []
+    if server_pid and not worker_rss and server_pid in peak_rss:
+        worker_rss = [peak_rss[server_pid]]
+    return {
+        "requests": n_requests,
+        "ok": statuses.get(200, 0),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "wall_seconds": round(wall, 3),
+        "rps": round(statuses.get(200, 0) / wall, 2) if wall else None,
+        "latency": _percentiles(latencies),
+        "probe_latency": _percentiles(probe_latencies),
+        "peak_rss_mb_per_worker": [round(r / 2 ** 20, 1) for r in worker_rss],
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Load test the /audit service against a local mock FX provider")
+    p.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated hedge log sizes (rows) to upload")
+    p.add_argument("--requests", type=int, default=40, help="Uploads per size")
+    p.add_argument("--concurrency", type=int, default=8, help="Concurrent uploads in flight")
+    p.add_argument("--pairs", default="NZD/USD", help="Comma-separated pairs mixed into the generated logs")
+    p.add_argument("--url", help="Target an already running service instead of launching one")
+    p.add_argument("--port", type=int, default=8765, help="Port for the launched service")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the launched service")
+    p.add_argument("--provider-latency-ms", type=float, default=50.0, help="Mean mock provider latency")
+    p.add_argument("--provider-jitter-ms", type=float, default=10.0, help="Std-dev of mock provider latency")
+    p.add_argument("--provider-failure-rate", type=float, default=0.0, help="Fraction of provider calls answered with HTTP 500")
+    p.add_argument("--quota-per-minute", type=float, default=6000.0, help="RATE_QUOTA_PER_MINUTE for the launched service")
+    p.add_argument("--max-staleness", type=float, help="max_staleness_seconds form field sent with every upload")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", help="Also write the report to this JSON file")
+    args = p.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    pairs = [s.strip().upper() for s in args.pairs.split(",") if s.strip()]
+    form = {} if len(pairs) > 1 else {"base": pairs[0].split("/")[0], "quote": pairs[0].split("/")[1]}
+    if args.max_staleness is not None:
+        form["max_staleness_seconds"] = str(args.max_staleness)
+
+    provider = MockProvider(args.provider_latency_ms, args.provider_jitter_ms, args.provider_failure_rate, seed=args.seed).start()
+    proc = None
+    cache_dir = tempfile.mkdtemp(prefix="loadtest_")
+    try:
+        if args.url:
+            url, server_pid = args.url.rstrip("/"), None
+        else:
+            proc = start_service(args.port, args.workers, provider.url, {
+                "RATE_CACHE_PATH": os.path.join(cache_dir, "rate_cache.db"),
+                "RATE_QUOTA_PER_MINUTE": str(args.quota_per_minute),
+                "RATE_QUOTA_BURST": str(max(10, int(args.quota_per_minute // 60))),
+            })
+            url, server_pid = f"http://127.0.0.1:{args.port}", proc.pid
+        print(f"Mock provider at {provider.url} (latency {args.provider_latency_ms}±{args.provider_jitter_ms} ms, "
+              f"failure rate {args.provider_failure_rate}); service at {url}")
+
+        report = {"config": vars(args), "sizes": {}}
+        for rows in sizes:
+            payload = generate_hedge_log(rows, pairs, seed=args.seed)
+            calls_before = provider.calls
+            result = run_size(url, payload, "hedge_log_loadtest.csv", args.requests, args.concurrency, form, server_pid)
+            result["upload_mb"] = round(len(payload) / 2 ** 20, 2)
+            result["provider_calls"] = provider.calls - calls_before
+            report["sizes"][rows] = result
+            lat, probe = result["latency"], result["probe_latency"]
+            print(f"{rows:>9} rows ({result['upload_mb']} MB): {result['ok']}/{result['requests']} ok, "
+                  f"{result['rps']} req/s, p50 {lat['p50_ms']} / p90 {lat['p90_ms']} / p99 {lat['p99_ms']} ms, "
+                  f"probe p99 {probe['p99_ms']} ms, provider calls {result['provider_calls']}, "
+                  f"peak RSS/worker {result['peak_rss_mb_per_worker']} MB, statuses {result['statuses']}")
+        report["provider"] = {"calls": provider.calls, "failures": provider.failures}
+
+        if args.json:
+            with open(args.json, "w") as fh:
+                json.dump(report, fh, indent=2)
+            print("Saved report to", args.json)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        provider.stop()
+
+
+if __name__ == "__main__":
+    main()
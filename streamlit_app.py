@@ -6,8 +6,8 @@ Streamlit front-end for Hedge Audit Demo
 
 import os
 import sys
-import io
 import random
+import time
 from datetime import datetime, date, timedelta, timezone
 
 
@@ -18,16 +18,22 @@ if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 
-from validators import infer_pair_from_df_or_filename, validate_schema
+from validators import infer_pair_from_df_or_filename, validate_rows, parse_row_pairs, unique_pairs, SUPPORTED_CURRENCIES
 from audit.evaluator import evaluate_dataframe
-from audit.summary import compute_summary
-from ingest.rate_fetcher import fetch_actual_rate
+from audit.summary import DEFAULT_ROUND, model_metrics
+from audit.cube import build_cube, slice_cube, summary_from_cube, cube_breakdown, rolling_from_cube
+from audit.sketch import ErrorDistribution
+from audit.timestamps import detect_format
+from ingest.rate_fetcher import fetch_rate_with_age, fetch_rates_with_age, MAX_STALENESS_SECONDS
 from fpdf import FPDF
 import matplotlib.pyplot as plt
 import tempfile
 
+CHUNK_ROWS = 50_000  # rows parsed, validated and evaluated per step
+
 st.set_page_config(page_title="Hedge Audit Demo", layout="wide")
 st.title("Hedge Audit Demo")
 
@@ -86,6 +92,12 @@ with st.sidebar:
     infer_pair = st.checkbox("Infer currency pair from file (if no Pair column)", value=True)
     use_yesterday = st.checkbox("Use yesterday 23:59 UTC for rate fetch (avoid midnight ambiguity)", value=True)
     show_preview_rows = st.slider("Preview rows", min_value=5, max_value=200, value=50, step=5)
+    rolling_window = st.selectbox("Rolling window", ["7D", "30D"], index=0)
+    max_staleness_min = st.number_input(
+        "Serve cached rate up to (minutes old)", min_value=0, max_value=24 * 60,
+        value=int(MAX_STALENESS_SECONDS // 60),
+        help="0 always calls the provider. Otherwise a recent cached rate is used immediately and refreshed in the background."
+    )
     st.markdown("---")
     st.markdown("Sample CSV: header should include")
     st.code("Timestamp,Predicted_Rate,Live_Rate,Decision,Pair")
@@ -125,25 +137,23 @@ def _display_error(msg: str):
     raise RuntimeError(msg)
 
 @st.cache_data(ttl=60 * 60)
-def _cached_fetch_rate(base: str, quote: str, use_yesterday_flag: bool):
+def _cached_fetch_rate(base: str, quote: str, use_yesterday_flag: bool, max_staleness_seconds: float = 0):
+    """Returns (rate, rate_timestamp) so the age stays correct on cache hits."""
     b = (base or "").upper().strip()
     q = (quote or "").upper().strip()
 
     # --- Currency validation guardrail ---
-    SUPPORTED = {
-        "USD","EUR","GBP","JPY","AUD","NZD","CAD","CHF",
-        "SEK","NOK","CNY","HKD","SGD"  # extend as needed
-    }
-    if b not in SUPPORTED or q not in SUPPORTED:
+    if b not in SUPPORTED_CURRENCIES or q not in SUPPORTED_CURRENCIES:
         _display_error(
             f"Unsupported currency pair: {b}/{q}. "
             f"Please use valid ISO codes like EUR/USD."
         )
 
     # --- Normal provider call ---
-    return fetch_actual_rate(b, q, as_of_yesterday=use_yesterday_flag)
+    rate, age = fetch_rate_with_age(b, q, as_of_yesterday=use_yesterday_flag, max_staleness=max_staleness_seconds)
+    return rate, (time.time() - age) if age is not None else None
 
-def build_pdf_report(base, quote, actual_rate, summary, audited):
+def build_pdf_report(pair_label, actual_rate, summary, audited):
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", "B", 16)
@@ -154,7 +164,7 @@ def build_pdf_report(base, quote, actual_rate, summary, audited):
 
     pdf.set_font("Arial", "", 12)
     pdf.ln(10)
-    pdf.cell(200, 10, f"Currency Pair: {base}/{quote}", ln=True)
+    pdf.cell(200, 10, f"Currency Pair: {pair_label}", ln=True)
     pdf.cell(200, 10, f"Rate Used: {actual_rate}", ln=True)
     pdf.cell(200, 10, f"Rows Audited: {len(audited)}", ln=True)
 
@@ -200,25 +210,23 @@ Key Finding:
     return pdf.output(dest="S").encode("latin-1")
 
 
-# more Friendly Schema Validator 
-
-
-# --- Friendly Schema Validator ---
-def validate_schema(df):
+# --- Friendly column preparation (row checks live in validators.validate_rows) ---
+def prepare_columns(df, warn: bool = True):
     """
-    Friendly schema validator:
+    Friendly column preparation (warn=False for later chunks of the same file):
     - Requires only core columns
     - Accepts optional extras
     - Aliases CorrectDecision -> Decision if needed
     - Ensures CorrectDecision is numeric (0/1)
-    - Cleans Notional column to numeric (defaults to 0 if missing/invalid)
     - Fills missing optional columns with None
     """
 
     required = {"Timestamp", "Predicted_Rate", "Live_Rate"}
     optional = {"Decision", "CorrectDecision", "HelpfulOutcome", "Notional"}
 
-    # Check required
+    # Check required (multi-model logs may carry only Predicted_Rate_<model> columns)
+    if any(str(c).startswith("Predicted_Rate_") for c in df.columns):
+        required = required - {"Predicted_Rate"}
     missing = required - set(df.columns)
     if missing:
         raise RuntimeError(f"CSV missing required columns: {', '.join(missing)}")
@@ -240,29 +248,53 @@ def validate_schema(df):
               .astype(int)
         )
 
-    # Clean Notional column if present
-    if "Notional" in df.columns:
-        df["Notional"] = pd.to_numeric(df["Notional"], errors="coerce").fillna(0)
-
-    # Add placeholders for any missing optional columns
-    for col in optional:
-        if col not in df.columns:
-            df[col] = None
-
-    # Warn if optional columns are missing
+    # Warn if optional columns are missing, then add placeholders for them
     missing_optional = optional - set(df.columns)
-    if missing_optional:
-        import streamlit as st
+    if missing_optional and warn:
         st.warning(
             f"Some optional columns are missing: {', '.join(missing_optional)}. "
             "Charts may be limited, but the app will still run."
         )
+    for col in missing_optional:
+        df[col] = None
 
     return df
 
 
 
 
+def _upload_chunks(uploaded, chunk_rows: int = CHUNK_ROWS):
+    """Parse the upload in chunks straight from its buffer; yields (chunk, fraction of the file read)."""
+    uploaded.seek(0)
+    size = getattr(uploaded, "size", 0) or 0
+    for chunk in pd.read_csv(uploaded, chunksize=chunk_rows):
+        yield chunk, (min(1.0, uploaded.tell() / size) if size else None)
+
+def _accumulate(totals: dict, audited_chunk: pd.DataFrame) -> None:
+    """Running sums behind the partial metrics shown while chunks are processed."""
+    err = pd.to_numeric(audited_chunk["Error"], errors="coerce").dropna()
+    direction = pd.to_numeric(audited_chunk["CorrectDirection"], errors="coerce").dropna()
+    totals["rows"] += len(audited_chunk)
+    totals["evaluated"] += int(audited_chunk["Actual"].notna().sum())
+    totals["err_n"] += len(err)
+    totals["err_sq"] += float((err ** 2).sum())
+    totals["dir_n"] += len(direction)
+    totals["dir_sum"] += float(direction.sum())
+    totals["profitable"] += int((audited_chunk["HedgeOutcome"] == "Profitable").sum())
+
+def _show_partial(totals: dict) -> None:
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Rows processed", f"{totals['rows']:,}")
+    c2.metric("Directional accuracy", f"{totals['dir_sum'] / totals['dir_n']:.2%}" if totals["dir_n"] else "—")
+    c3.metric("RMSE", f"{(totals['err_sq'] / totals['err_n']) ** 0.5:.5f}" if totals["err_n"] else "—")
+    c4.metric("% profitable", f"{totals['profitable'] / totals['evaluated']:.1%}" if totals["evaluated"] else "—")
+
+
+# A rerun while an audit was still running means it was cancelled (Cancel button or another widget)
+if st.session_state.get("_audit_running") and not run:
+    st.warning(f"Audit cancelled after {st.session_state.get('_audit_rows', 0):,} rows; partial results were discarded.")
+    st.session_state["_audit_running"] = False
+
 # --- Main audit logic ---
 if run:
     audit_success = False
@@ -271,23 +303,25 @@ if run:
     df = None
     filename = None
 
-    # Load DataFrame
+    # Load the first chunk; the rest is read from the upload buffer as processing goes
     if "_sample_df" in st.session_state and st.session_state.get("_sample_df") is not None and uploaded is None:
-        df = st.session_state["_sample_df"]
+        chunks = iter([(st.session_state["_sample_df"].copy(deep=False), 1.0)])
         filename = "sample.csv"
     elif uploaded is not None:
-        try:
-            uploaded.seek(0)
-            df = pd.read_csv(io.BytesIO(uploaded.read()))
-            filename = getattr(uploaded, "name", "uploaded.csv") or "uploaded.csv"
-        except Exception as e:
-            _display_error(f"Failed to parse uploaded CSV: {e}")
+        chunks = _upload_chunks(uploaded)
+        filename = getattr(uploaded, "name", "uploaded.csv") or "uploaded.csv"
     else:
         _display_error("Please upload a CSV or load the sample CSV.")
+    try:
+        df, first_progress = next(chunks)
+    except StopIteration:
+        _display_error("The uploaded CSV has no rows.")
+    except Exception as e:
+        _display_error(f"Failed to parse uploaded CSV: {e}")
 
     # Validate schema (friendly mode with fallback)
     try:
-        df = validate_schema(df)
+        df = prepare_columns(df)
     except RuntimeError as e:
         st.warning(f"{e} — falling back to sample NZD/AUD dataset for demo.")
         # --- Fallback sample dataset ---
@@ -308,34 +342,21 @@ if run:
             "Notional": np.random.choice([50_000, 100_000, 250_000], size=n)
         })
         filename = "fallback_nzd_aud.csv"
+        chunks, first_progress = iter([]), 1.0
 
-    # --- Normalize Decision column ---
-    if "Decision" in df.columns and "CorrectDecision" not in df.columns:
-        df["CorrectDecision"] = df["Decision"].map(
-            {"Correct": 1, "Incorrect": 0}
-        )
-
-    # Normalize Timestamp column automatically
-    if "Timestamp" in df.columns:
-        df["Timestamp"] = df["Timestamp"].astype(str).str.strip()
-        parsed = pd.to_datetime(df["Timestamp"], format="%Y-%m-%d", errors="coerce")
-        if parsed.isna().any():
-            parsed = pd.to_datetime(df["Timestamp"], errors="coerce", dayfirst=False)
-        df["Timestamp"] = parsed
-
-        # Count bad rows
-        bad_rows = df["Timestamp"].isna().sum()
-        if bad_rows > 0:
-            st.warning(f"{bad_rows} rows had invalid or unrecognized dates and were excluded.")
-            df = df.dropna(subset=["Timestamp"])
-
-    # Parse actual rate or infer pair
+    # Parse actual rate or infer pair (from the first chunk)
     actual_rate = _parse_actual(actual_input)
 
     base = (base or "").upper().strip()
     quote = (quote or "").upper().strip()
 
-    if actual_rate is None:
+    # With an inferred rate, rows are rated by their own pair: a file (or a later chunk) with
+    # several pairs switches to per-pair rates, fetching each new pair concurrently as it appears
+    infer_rows = actual_rate is None and not (base and quote) and infer_pair
+    rate_state = {"pairs": None, "age": None}
+    if infer_rows and len(unique_pairs(parse_row_pairs(df))) > 1:
+        rate_state["pairs"] = {}
+    elif actual_rate is None:
         if base and quote:
             pass
         elif infer_pair:
@@ -352,25 +373,121 @@ if run:
         if not base or not quote:
             _display_error("Base or quote currency is empty after inference; cannot fetch rate.")
 
-        actual_rate = _cached_fetch_rate(base, quote, use_yesterday)
+        actual_rate, rate_ts = _cached_fetch_rate(base, quote, use_yesterday, max_staleness_min * 60)
+        rate_state["age"] = time.time() - rate_ts if rate_ts is not None else None
         if actual_rate is None:
-            fallback_rate = 0.6123 if (base, quote) == ("NZD", "USD") else None
-            if fallback_rate is not None:
-                st.warning(f"Using fallback rate for {base}/{quote}: {fallback_rate}")
-                actual_rate = fallback_rate
-            else:
-                _display_error(f"Rate provider returned no rate for {base}/{quote}, and no fallback is available.")
+            # the fetcher already falls back to the last cached rate; nothing cached means no rate at all
+            _display_error(f"Rate provider returned no rate for {base}/{quote}, and no cached rate is available.")
+
+    def _chunk_rates(chunk):
+        """Actual rate(s) for one validated chunk."""
+        if not infer_rows:
+            return actual_rate
+        keys = parse_row_pairs(chunk)
+        if rate_state["pairs"] is None:
+            if set(keys.dropna().unique()) <= {f"{base}/{quote}"}:
+                return actual_rate
+            rate_state["pairs"] = {f"{base}/{quote}": actual_rate}
+        new_pairs = [p for p in unique_pairs(keys) if f"{p[0]}/{p[1]}" not in rate_state["pairs"]]
+        if new_pairs:
+            fetched = fetch_rates_with_age(new_pairs, as_of_yesterday=use_yesterday, max_staleness=max_staleness_min * 60)
+            failed = [f"{b}/{q}" for (b, q), (r, _age) in fetched.items() if r is None]
+            if failed:
+                _display_error(f"Rate provider returned no rate for {', '.join(failed)}.")
+            rate_state["pairs"].update({f"{b}/{q}": r for (b, q), (r, _age) in fetched.items()})
+            rate_state["age"] = max([a for _r, a in fetched.values()] + [rate_state["age"] or 0.0])
+        if "Pair" not in chunk.columns:
+            chunk["Pair"] = keys
+        return keys.map(rate_state["pairs"])
+
+    # Process chunk by chunk: validate, evaluate, update the running metrics
+    st.session_state.pop("_cube", None)
+    st.session_state["_audit_running"] = True
+    st.session_state["_audit_rows"] = 0
+    progress = st.progress(0.0, text="Auditing...")
+    st.button("Cancel audit", help="Stops processing; partial results are discarded.")
+    partial = st.empty()
+    # timestamp format fixed from the first chunk so ambiguous dates read the same way in every chunk
+    ts_format = detect_format(df["Timestamp"])
+    # blank pair cells: one pair for the whole file, never a single chunk's only pair. With one rate for
+    # every row that is the audited pair; with per-row rates only a pair named in the file name qualifies.
+    fallback_pair = (base, quote) if not infer_rows and base and quote else None
+    totals = {"rows": 0, "evaluated": 0, "err_n": 0, "err_sq": 0.0, "dir_n": 0, "dir_sum": 0.0, "profitable": 0}
+    audited_parts, rejected_parts, rejected_counts = [], [], {}
+    try:
+        next_chunk = (df, first_progress)
+        while next_chunk is not None:
+            chunk, fraction = next_chunk
+            # --- Row validation (shared engine): report rejected rows instead of dropping them silently.
+            # Timestamps are parsed here once (with the file's format) and stored as datetimes.
+            validation = validate_rows(chunk, timestamp_format=ts_format, filename=filename,
+                                      fallback_pair=fallback_pair, whole_file=False)
+            if len(validation.rejected):
+                rejected_parts.append(validation.rejected)
+                for reason, count in validation.counts.items():
+                    rejected_counts[reason] = rejected_counts.get(reason, 0) + count
+            if not validation.clean.empty:
+                audited_chunk = evaluate_dataframe(validation.clean, actual_rate=_chunk_rates(validation.clean),
+                                                   fill_missing_only=True)
+                audited_parts.append(audited_chunk)
+                _accumulate(totals, audited_chunk)
+
+            st.session_state["_audit_rows"] = totals["rows"]
+            done = fraction if fraction is not None else 0.0
+            progress.progress(done, text=f"Audited {totals['rows']:,} rows ({done:.0%} of file)")
+            with partial.container():
+                _show_partial(totals)
 
-    # Run audit
+            try:
+                chunk, fraction = next(chunks)
+                next_chunk = (prepare_columns(chunk, warn=False), fraction)
+            except StopIteration:
+                next_chunk = None
+            except Exception as e:
+                _display_error(f"Failed to parse uploaded CSV: {e}")
+
+        progress.progress(1.0, text=f"Audited {totals['rows']:,} rows")
+        if rejected_parts:
+            rejected = pd.concat(rejected_parts)
+            reasons = ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in rejected_counts.items())
+            st.warning(f"{len(rejected)} rows were rejected and excluded from the audit ({reasons}).")
+            with st.expander("Rejected rows"):
+                st.dataframe(rejected)
+        if not audited_parts:
+            _display_error("No valid rows left to audit after validation.")
+    except RuntimeError:
+        # a reported error, not a cancel: don't show "cancelled" on the next rerun
+        st.session_state["_audit_running"] = False
+        raise
+
+    rate_age = rate_state["age"]
+    if rate_state["pairs"] is not None:
+        actual_rate = rate_state["pairs"]
+    pair_label = ", ".join(actual_rate) if rate_state["pairs"] is not None else f"{base}/{quote}"
+
+    # Summaries over the whole audited frame
     try:
-        with st.spinner("Fetching rate and evaluating..."):
-            audited = evaluate_dataframe(df, actual_rate=actual_rate, fill_missing_only=True)
-            summary = compute_summary(audited, by_pair=True)
+        with st.spinner("Summarizing..."):
+            audited = pd.concat(audited_parts) if len(audited_parts) > 1 else audited_parts[0]
+            # (Pair, Decision, Day) cube: the summary, P&L, rolling charts and drill-downs read from it
+            cube = build_cube(audited)
+            st.session_state["_cube"] = cube
+            summary = summary_from_cube(cube, by_pair=True)
+            # rows are read again only for what the cube cannot hold: the error distribution and per-model columns
+            error_dist = ErrorDistribution.from_errors(audited["Error"]) if "Error" in audited.columns else None
+            if error_dist is not None:
+                summary["abs_error_quantiles"] = error_dist.report(DEFAULT_ROUND)
+            models = model_metrics(audited)
+            if models:
+                summary["models"] = models
+            rolling = rolling_from_cube(cube, window=rolling_window)
             audit_success = True
     except Exception as e:
         st.error(f"Unexpected error during audit: {e}")
         audit_success = False
         raise
+    finally:
+        st.session_state["_audit_running"] = False
 
     # Display results
     if audit_success:
@@ -378,10 +495,14 @@ if run:
 
         # --- Cover / Header ---
         st.markdown("## 📑 Hedge Audit Report")
-        st.markdown(f"**Currency Pair:** {base}/{quote}")
+        st.markdown(f"**Currency Pair:** {pair_label}")
         st.markdown(f"**Audit Date:** {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S %Z')}")
         st.markdown(f"**Rows Audited:** {len(audited)}")
         st.markdown(f"**Rate Used:** {actual_rate}")
+        if rate_age and rate_age > max_staleness_min * 60:
+            st.warning(f"Rate provider unavailable — using the last cached rate, {rate_age / 3600:.1f} hours old.")
+        elif rate_age:
+            st.caption(f"Served from cache — rate is {rate_age / 60:.1f} minutes old (refreshing in the background).")
 
         st.markdown("---")
 
@@ -443,20 +564,10 @@ if run:
             "Key Finding": key_finding
         })
 
-            # --- Rolling Accuracy (safe cast) ---
-        if "CorrectDecision" in audited.columns:
-            df_acc = audited.copy()
-            df_acc["CorrectDecision"] = (
-                pd.to_numeric(df_acc["CorrectDecision"], errors="coerce")
-                  .fillna(0)
-                  .astype(int)
-            )
-            df_acc["RollingAccuracy"] = (
-                df_acc["CorrectDecision"].rolling(window=7, min_periods=1).mean()
-            )
-
-            st.line_chart(df_acc[["RollingAccuracy"]])
-            st.caption("🔹 Rolling 7‑day Accuracy — shows how consistent the model’s decisions were over time.")
+            # --- Rolling Accuracy (shared rolling metrics, one line per pair) ---
+        if not rolling.empty:
+            st.line_chart(rolling.pivot_table(index="Timestamp", columns="Pair", values="directional_accuracy"))
+            st.caption(f"🔹 Rolling {rolling_window} Accuracy — shows how consistent the model’s directional calls were over time.")
 
       
            # --- Key Metrics Table ---
@@ -470,22 +581,29 @@ if run:
         }
         st.table(pd.DataFrame(metrics_table))
 
+        # --- Model comparison (Predicted_Rate_<model> columns) ---
+        if summary.get("models"):
+            st.markdown("### 🧪 Model Comparison")
+            st.table(pd.DataFrame(summary["models"]).T)
+            st.caption("🔹 Each prediction column audited against the same actual rate in one pass.")
+
         # --- Visuals ---
         st.markdown("### 📈 Visuals")
 
         import altair as alt
 
         if {"Predicted_Rate", "Live_Rate"}.issubset(audited.columns):
-            audited = audited.copy()
-            audited["Day"] = range(1, len(audited) + 1)
+            # only the plotted columns go to the charts; Day and Diff are derived in the chart spec
+            rates = audited[["Predicted_Rate", "Live_Rate"]]
 
             # Calculate min/max for dynamic y-axis zoom
-            y_min = audited[["Predicted_Rate", "Live_Rate"]].min().min()
-            y_max = audited[["Predicted_Rate", "Live_Rate"]].max().max()
+            y_min = rates.min().min()
+            y_max = rates.max().max()
 
             # Comparison chart
             line_chart = (
-                alt.Chart(audited)
+                alt.Chart(rates)
+                .transform_window(Day="row_number()")
                 .mark_line(point=True)
                 .encode(
                     x=alt.X("Day:O", title="Day"),
@@ -507,9 +625,10 @@ if run:
             st.caption("🔹 Predicted vs Live Rates — shows how closely the model tracks actual NZD/AUD market moves.")
 
             # Difference chart
-            audited["Diff"] = audited["Live_Rate"] - audited["Predicted_Rate"]
             diff_chart = (
-                alt.Chart(audited)
+                alt.Chart(rates)
+                .transform_window(Day="row_number()")
+                .transform_calculate(Diff="datum.Live_Rate - datum.Predicted_Rate")
                 .mark_line(point=True, color="red")
                 .encode(
                     x=alt.X("Day:O", title="Day"),
@@ -531,33 +650,33 @@ if run:
 
 
 
-        # --- Rolling Accuracy ---
-        st.markdown("### 📈 Rolling Accuracy (7-day window)")
-        if "CorrectDecision" in audited.columns and "Timestamp" in audited.columns:
-            df_acc = audited.copy()
-            df_acc["Timestamp"] = pd.to_datetime(df_acc["Timestamp"])
-            df_acc = df_acc.sort_values("Timestamp")
-            df_acc["RollingAccuracy"] = (
-                df_acc["CorrectDecision"].astype(int).rolling(window=7, min_periods=1).mean()
-            )
-            st.line_chart(df_acc.set_index("Timestamp")["RollingAccuracy"])
+        # --- Rolling Error ---
+        st.markdown(f"### 📈 Rolling Error ({rolling_window} window)")
+        if not rolling.empty:
+            st.line_chart(rolling.pivot_table(index="Timestamp", columns="Pair", values="rmse"))
+            st.caption(f"🔹 Rolling {rolling_window} RMSE per pair — gaps in the log shrink the window instead of stretching it.")
 
         # --- Error Distribution ---
         st.markdown("### 📊 Error Distribution")
         if "Error" in audited.columns:
-            st.bar_chart(audited["Error"].round(4).value_counts().sort_index())
-
-        # --- Weighted Accuracy (if Notional column exists) ---
-        if "Notional" in audited.columns and "CorrectDecision" in audited.columns:
-            total_notional = audited["Notional"].sum()
-            if total_notional > 0:
-                weighted_acc = (
-                    (audited["CorrectDecision"].astype(int) * audited["Notional"]).sum()
-                    / total_notional
-                )
+            st.bar_chart(error_dist.histogram.to_series())
+            st.write({f"|Error| {k}": v for k, v in summary.get("abs_error_quantiles", {}).items()})
+
+        # --- Weighted Accuracy, P&L and Exposure (if Notional column exists) ---
+        if "Notional" in audited.columns:
+            weighted_acc = summary["value_weighted_accuracy"]
+            if weighted_acc is not None:
                 st.metric("Value-Weighted Accuracy", f"{weighted_acc:.2%}")
             else:
                 st.warning("Notional values sum to zero — cannot compute weighted accuracy.")
+        if "pnl_by_currency" in summary:
+            st.markdown("### 💰 Hedge vs Wait P&L")
+            st.table(pd.DataFrame(summary["pnl_by_currency"]).T.rename(
+                columns={"hedge": "Hedge P&L vs Waiting", "wait": "Wait P&L vs Hedging", "total": "Decision P&L"}))
+            st.caption("🔹 Notional × rate move, totalled per quote currency (amounts in different currencies are never added).")
+            st.markdown("### 💼 Exposure by Pair")
+            st.table(pd.DataFrame(summary["exposure_by_pair"]).T)
+            st.caption("🔹 Notional (base currency) on Hedge now / Wait rows.")
 
         # --- Detailed Findings ---
         st.markdown("### 🔍 Detailed Findings")
@@ -577,7 +696,7 @@ if run:
 
                # --- PDF Export ---
         
-        pdf_bytes = build_pdf_report(base, quote, actual_rate, summary, audited)
+        pdf_bytes = build_pdf_report(pair_label, actual_rate, summary, audited)
 
         # Streamlit download button
         st.download_button(
@@ -600,3 +719,32 @@ if run:
 
 
   
+
+
+# --- Drill-down: answered from the stored cube, so it survives reruns and never rescans rows ---
+drill_cube = st.session_state.get("_cube")
+if drill_cube is not None and not drill_cube.empty:
+    st.markdown("### 🔎 Drill-down")
+    d1, d2, d3 = st.columns(3)
+    drill_pairs = d1.multiselect("Pairs", sorted(drill_cube["Pair"].unique()), key="drill_pairs")
+    drill_decisions = d2.multiselect("Decisions", sorted(drill_cube["Decision"].unique()), key="drill_decisions")
+    drill_freq = d3.selectbox("Bucket", ["D", "W", "M"], index=1, key="drill_freq",
+                              format_func={"D": "Day", "W": "Week", "M": "Month"}.get)
+    drill_days = drill_cube["Day"].dropna()
+    drill_range = ()
+    if not drill_days.empty:
+        drill_range = st.date_input("Date range", value=(drill_days.min().date(), drill_days.max().date()), key="drill_range")
+    start, end = (drill_range[0], drill_range[-1]) if len(drill_range) else (None, None)
+
+    sliced = slice_cube(drill_cube, pairs=drill_pairs or None, decisions=drill_decisions or None, start=start, end=end)
+    drill = summary_from_cube(sliced)
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Rows", f"{drill['total_rows']:,}")
+    m2.metric("Directional accuracy", f"{drill['directional_accuracy']:.2%}" if drill["directional_accuracy"] is not None else "—")
+    m3.metric("RMSE", f"{drill['rmse']:.5f}" if drill["rmse"] is not None else "—")
+    m4.metric("Value-weighted accuracy", f"{drill['value_weighted_accuracy']:.2%}" if drill["value_weighted_accuracy"] is not None else "—")
+
+    by_bucket = cube_breakdown(sliced, by=["Day"], freq=drill_freq)
+    if not by_bucket.empty:
+        st.line_chart(by_bucket.set_index("Day")[["directional_accuracy", "value_weighted_accuracy"]])
+    st.dataframe(cube_breakdown(sliced, by=["Pair", "Decision"]))
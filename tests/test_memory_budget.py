@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Peak-memory budget for the audit pipeline (validate_rows -> evaluate_dataframe -> compute_summary).
+
+Evaluation and summarisation work on shallow views and add only their own columns, so the
+whole pipeline should stay within a small multiple of the input frame. A stage that starts
+deep-copying the frame again (DataFrame.copy, DataFrame.assign, per-pair full slices) pushes
+the traced peak over the budget.
+
+The budget is measured in column buffers (memory_usage(deep=False)), not in deep size: a
+copy duplicates every column's values or object pointers but never the strings they point
+to, so a deep-size budget would be dominated by strings no regression ever copies.
+"""
+
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import audit.evaluator
+from audit.evaluator import evaluate_dataframe
+from audit.summary import compute_summary
+from validators import validate_rows
+
+ROWS = 100_000
+PEAK_BUDGET = 5.5  # x the input frame's column buffers; one extra full-frame copy lands above it
+
+
+def _hedge_log(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    live = 0.6 * (1 + rng.normal(0, 0.005, rows))
+    return pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=rows, freq="min").strftime("%Y-%m-%d %H:%M:%S"),
+        "Predicted_Rate": live * (1 + rng.normal(0, 0.003, rows)),
+        "Live_Rate": live,
+        "Decision": rng.choice(["Hedge now", "Wait"], rows),
+        "Pair": rng.choice(["NZD/USD", "AUD/USD", "EUR/USD"], rows),
+        "Notional": rng.integers(10_000, 1_000_000, rows),
+    })
+
+
+def _pipeline_peak(raw: pd.DataFrame):
+    tracemalloc.start()
+    try:
+        clean = validate_rows(raw).clean
+        audited = evaluate_dataframe(clean, actual_rate=0.6)
+        summary = compute_summary(audited, by_pair=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summary, peak / raw.memory_usage(deep=False).sum()
+
+
+def test_pipeline_peak_memory_within_budget():
+    summary, ratio = _pipeline_peak(_hedge_log(ROWS))
+
+    assert summary["rows_evaluated"] == ROWS
+    assert ratio < PEAK_BUDGET, f"peak {ratio:.2f}x input column buffers (budget {PEAK_BUDGET}x)"
+
+
+def test_budget_catches_a_full_frame_copy(monkeypatch):
+    # the regression the budget guards against: evaluate_dataframe deep-copying its input again
+    normalize_df = audit.evaluator.normalize_df
+    monkeypatch.setattr(audit.evaluator, "normalize_df", lambda df: normalize_df(df).copy())
+
+    _, ratio = _pipeline_peak(_hedge_log(ROWS))
+
+    assert ratio > PEAK_BUDGET, f"peak {ratio:.2f}x with a deep copy restored is within the budget"
+
+
+def test_pipeline_leaves_input_untouched():
+    raw = _hedge_log(1_000)
+    raw["Actual"] = np.where(np.arange(len(raw)) % 2, 0.61, np.nan)
+    before = raw.copy()
+
+    audited = evaluate_dataframe(validate_rows(raw).clean, actual_rate=0.6)
+    compute_summary(audited, by_pair=True)
+
+    pd.testing.assert_frame_equal(raw, before)
+    assert audited["Actual"].notna().all()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+audit_partitioned against the single-process path: the audited frame must be identical and
+the summary must match compute_summary (abs_error_quantiles aside, which come from merged
+sketches with the same error bound).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from audit.evaluator import evaluate_dataframe
+from audit.parallel import audit_partitioned, shutdown_pool
+from audit.summary import compute_summary
+
+ROWS = 20_000
+
+
+@pytest.fixture(autouse=True)
+def _pool():
+    yield
+    shutdown_pool()
+
+
+def _hedge_log(rows: int = ROWS) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    live = 0.6 * (1 + rng.normal(0, 0.005, rows))
+    df = pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=rows, freq="min"),
+        "Predicted_Rate": live * (1 + rng.normal(0, 0.003, rows)),
+        "Predicted_Rate_alt": live * (1 + rng.normal(0, 0.004, rows)),
+        "Live_Rate": live,
+        "Decision": rng.choice(["Hedge now", "Wait", None], rows),
+        "Pair": rng.choice(["NZD/USD", "AUD/USD", None], rows),
+        "Notional": rng.integers(10_000, 1_000_000, rows).astype(float),
+    })
+    df.loc[::97, "Predicted_Rate"] = np.nan
+    return df
+
+
+def _without_quantiles(summary):
+    if isinstance(summary, dict):
+        return {k: _without_quantiles(v) for k, v in summary.items() if k != "abs_error_quantiles"}
+    return summary
+
+
+def _assert_summaries_match(got, expected, path="summary"):
+    if isinstance(expected, dict):
+        assert set(got) == set(expected), path
+        for key in expected:
+            _assert_summaries_match(got[key], expected[key], f"{path}.{key}")
+    elif isinstance(expected, float):
+        assert got == pytest.approx(expected, rel=1e-9, abs=1e-12), path
+    else:
+        assert got == expected, path
+
+
+@pytest.mark.parametrize("actual_rate", [0.6, "per_row"])
+def test_partitioned_matches_single_process(actual_rate):
+    df = _hedge_log()
+    if actual_rate == "per_row":
+        actual_rate = pd.Series(np.where(df["Pair"] == "AUD/USD", 0.605, 0.6), index=df.index)
+
+    audited, summary = audit_partitioned(df, actual_rate, workers=2, partitions=4)
+    expected = evaluate_dataframe(df, actual_rate=actual_rate)
+    expected_summary = compute_summary(expected, by_pair=True)
+
+    pd.testing.assert_frame_equal(audited, expected)
+    _assert_summaries_match(_without_quantiles(summary), _without_quantiles(expected_summary))
+    assert summary["abs_error_quantiles"]["max_abs"] == expected_summary["abs_error_quantiles"]["max_abs"]
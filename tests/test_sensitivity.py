@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+The what-if sweep against its definition: every point of sweep_actual_rates must equal
+evaluate_dataframe + compute_summary run with that candidate as the actual rate.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from audit.evaluator import evaluate_dataframe
+from audit.sensitivity import rate_multipliers, sweep_actual_rates
+from audit.summary import compute_summary
+
+STEPS = 11
+PCT = 2.0
+# sweep column -> compute_summary key
+MATCHED = {
+    "rows_evaluated": "rows_evaluated",
+    "profitable": "profitable_hedges",
+    "should_have_hedged": "missed_hedges",
+    "percent_profitable": "percent_profitable",
+    "mean_error": "mean_error",
+    "rmse": "rmse",
+    "directional_accuracy": "directional_accuracy",
+}
+
+
+def _hedge_log(rows: int = 2_000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Timestamp": pd.date_range("2024-01-01", periods=rows, freq="h"),
+        "Predicted_Rate": 0.6 + rng.normal(0, 0.01, rows),
+        "Live_Rate": 0.6 + rng.normal(0, 0.01, rows),
+        "Decision": rng.choice(["Hedge now", "Wait", None], rows),
+        "Pair": rng.choice(["NZD/USD", "AUD/USD"], rows),
+    })
+    # rows the sweep must leave alone: no prediction, or an actual already recorded
+    df.loc[:10, "Predicted_Rate"] = np.nan
+    recorded = pd.Series(np.where((df.index >= 20) & (df.index < 40), 0.61, np.nan), index=df.index)
+    return evaluate_dataframe(df, actual_rate=recorded)
+
+
+@pytest.mark.parametrize("per_row", [False, True])
+def test_sweep_matches_per_candidate_audit(per_row):
+    df = _hedge_log()
+    centre = pd.Series(np.where(df["Pair"] == "NZD/USD", 0.6, 0.605), index=df.index) if per_row else 0.6
+
+    curve = sweep_actual_rates(df, centre, pct=PCT, steps=STEPS)
+
+    assert len(curve) == STEPS
+    for point, k in zip(curve.itertuples(index=False), rate_multipliers(PCT, STEPS)):
+        summary = compute_summary(evaluate_dataframe(df, actual_rate=centre * k))
+        for column, key in MATCHED.items():
+            assert getattr(point, column) == pytest.approx(summary[key], rel=1e-9, abs=1e-12), (k, column)
@@ -4,16 +4,55 @@
 Validation and pair inference helpers for Hedge Audit Demo
 """
 
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import os
 import re
+import numpy as np
 import pandas as pd
 
+from audit.timestamps import parse_timestamps
+
 REQUIRED_COLUMNS = ["Timestamp", "Predicted_Rate", "Live_Rate", "Decision"]
+MODEL_PREFIX = "Predicted_Rate_"
+
+SUPPORTED_CURRENCIES = {
+    "USD", "EUR", "GBP", "JPY", "AUD", "NZD", "CAD", "CHF",
+    "SEK", "NOK", "CNY", "HKD", "SGD",  # extend as needed
+}
+
+# decisions understood by audit.evaluator plus the aliases the dashboard and sample files use,
+# keyed case-insensitively; validate_rows writes the canonical label into the clean frame
+DECISION_LABELS = {
+    "hedge now": "Hedge now", "hedge": "Hedge now",
+    "wait": "Wait", "no hedge": "Wait",
+    "correct": "Correct", "incorrect": "Incorrect",
+}
+VALID_DECISIONS = set(DECISION_LABELS)
+
+# row rejection bits (a row can carry several)
+REJECT_REASONS = {
+    "bad_predicted_rate": 1,
+    "bad_live_rate": 2,
+    "bad_decision": 4,
+    "bad_timestamp": 8,
+    "unknown_pair": 16,
+    "bad_notional": 32,
+}
+
+
+class RowValidation(NamedTuple):
+    clean: pd.DataFrame          # accepted rows, rates/notional as floats, Timestamp parsed to datetime64
+    rejected: pd.DataFrame       # rejected rows as uploaded plus a RejectReasons column
+    reasons: np.ndarray          # uint8 bitmask per input row (0 = accepted)
+    counts: Dict[str, int]       # rows rejected per reason (only non-zero reasons)
 
 _FILENAME_PAIR_REGEXES = [
     re.compile(r"([A-Za-z]{3})[_-]?([A-Za-z]{3})", re.IGNORECASE),   # nzdusd, nzd_usd, NZD-USD
     re.compile(r"([A-Za-z]{3})/([A-Za-z]{3})", re.IGNORECASE),       # NZD/USD
 ]
+# overlapping scan: every 3+3 letter window, so a pair buried in a longer name is still found
+_FILENAME_PAIR_SCAN = re.compile(r"(?=([A-Za-z]{3})[_\-/]?([A-Za-z]{3}))")
 
 
 def validate_schema(df: pd.DataFrame) -> Tuple[bool, List[str]]:
@@ -22,18 +61,137 @@ def validate_schema(df: pd.DataFrame) -> Tuple[bool, List[str]]:
     Returns (ok, missing_columns).
     """
     cols_norm = {c.strip().lower().replace(" ", "_"): c for c in df.columns}
+    has_models = any(c.startswith(MODEL_PREFIX.lower()) for c in cols_norm)
     missing = []
     for req in REQUIRED_COLUMNS:
         key = req.strip().lower().replace(" ", "_")
-        if key not in cols_norm:
+        # multi-model logs may carry only Predicted_Rate_<model> columns
+        if key not in cols_norm and not (req == "Predicted_Rate" and has_models):
             missing.append(req)
     return (len(missing) == 0, missing)
 
 
+def validate_rows(df: pd.DataFrame, known_currencies: Optional[set] = None,
+                  timestamp_format: Optional[str] = None, filename: Optional[str] = None,
+                  fallback_pair: Optional[Tuple[str, str]] = None, whole_file: bool = True) -> RowValidation:
+    """
+    Check every row in one vectorized pass: numeric Predicted_Rate/Live_Rate (numeric or blank
+    Predicted_Rate_<model> columns), a known (or blank) Decision and Decision_<model>, a parseable
+    Timestamp, a recognised pair (when a pair column exists) and a numeric Notional (when present). Optional columns that are absent are not checked.
+    Rejected rows are returned with their reasons instead of being dropped silently.
+    timestamp_format fixes the Timestamp format (audit.timestamps.detect_format of the first chunk
+    when a file is validated chunk by chunk); by default it is sniffed from df.
+    Blank pair cells take fallback_pair (resolved once per file by the caller), else the pair named
+    by filename, else the file's only pair; in a mixed-pair file with none of these they are rejected
+    as unknown_pair. Pass whole_file=False when df is one chunk of a larger file: a chunk's only pair
+    need not be the file's, so without fallback_pair or a pair in filename blank pairs are rejected.
+    """
+    known = SUPPORTED_CURRENCIES if known_currencies is None else known_currencies
+    # shallow copy: renamed labels without duplicating the column data
+    df = df.copy(deep=False)
+    df.columns = [str(c).strip().replace(" ", "_") for c in df.columns]
+    n = len(df)
+    reasons = np.zeros(n, dtype=np.uint8)
+
+    def _flag(name: str, bad) -> None:
+        reasons[np.asarray(bad, dtype=bool)] |= REJECT_REASONS[name]
+
+    converted = {}
+    for col, reason in [("Predicted_Rate", "bad_predicted_rate"), ("Live_Rate", "bad_live_rate")]:
+        if col in df.columns:
+            converted[col] = pd.to_numeric(df[col], errors="coerce")
+            _flag(reason, converted[col].isna())
+
+    for col in (c for c in df.columns if c.startswith(MODEL_PREFIX)):
+        # a model may skip rows (blank), but what it did predict must be numeric
+        converted[col] = pd.to_numeric(df[col], errors="coerce")
+        _flag("bad_predicted_rate", converted[col].isna() & df[col].notna())
+
+    if "Notional" in df.columns:
+        converted["Notional"] = pd.to_numeric(df["Notional"], errors="coerce")
+        _flag("bad_notional", converted["Notional"].isna() & df["Notional"].notna())
+
+    # blank decisions are still audited (HedgeOutcome "Unknown"); unrecognised ones are not
+    for col in (c for c in df.columns if c == "Decision" or c.startswith("Decision_")):
+        decision = df[col]
+        label = decision.astype(str).str.strip().str.lower().map(DECISION_LABELS)
+        _flag("bad_decision", decision.notna() & label.isna())
+        # "wait" / "No Hedge" etc. become the exact labels audit.evaluator matches
+        if (decision.notna() & label.ne(decision)).any():
+            converted[col] = label.where(decision.notna(), decision)
+
+    if "Timestamp" in df.columns:
+        # parsed once here and stored in the clean frame so later stages never re-parse
+        converted["Timestamp"] = parse_timestamps(df["Timestamp"], fmt=timestamp_format)
+        _flag("bad_timestamp", converted["Timestamp"].isna())
+
+    pair_col = next((c for c in df.columns if c.lower() in ("pair", "currency_pair", "pair_name")), None)
+    split = "Base" in df.columns and "Quote" in df.columns
+    present = blank = None
+    if split:
+        present = df["Base"].notna() & df["Quote"].notna()
+        blank = df["Base"].isna() & df["Quote"].isna()
+    elif pair_col is not None:
+        present = df[pair_col].notna()
+        blank = ~present
+    if present is not None:
+        # only distinct keys are checked
+        keys = parse_row_pairs(df)
+        ok_keys = {k for k in keys.dropna().unique() if set(k.split("/")) <= known}
+        # a half-filled Base/Quote row names no pair
+        _flag("unknown_pair", ~present & ~blank)
+        _flag("unknown_pair", present & ~keys.isin(ok_keys))
+        if blank.any():
+            fallback = fallback_pair
+            if fallback is None and filename:
+                fallback = _known_pair_in_filename(filename, known)
+            if fallback is None and whole_file and len(ok_keys) == 1:
+                fallback = tuple(next(iter(ok_keys)).split("/"))
+            if fallback is None:
+                if len(ok_keys) > 1 or not whole_file:
+                    # a blank row in a mixed-pair (or only partly seen) file has no pair to be audited against
+                    _flag("unknown_pair", blank)
+            elif split:
+                converted["Base"] = df["Base"].where(~blank, fallback[0])
+                converted["Quote"] = df["Quote"].where(~blank, fallback[1])
+            else:
+                converted[pair_col] = df[pair_col].where(~blank, "/".join(fallback))
+
+    accepted = reasons == 0
+    rejected = df[~accepted].copy()
+    # a fully clean chunk stays a view of the input; converted columns replace (never overwrite) its own
+    keep = None if accepted.all() else np.flatnonzero(accepted)
+    clean = df if keep is None else df.take(keep)
+    for col, values in converted.items():
+        clean[col] = values if keep is None else values.take(keep)
+    if len(rejected):
+        codes = reasons[~accepted]
+        labels = {int(c): ",".join(name for name, bit in REJECT_REASONS.items() if c & bit) for c in np.unique(codes)}
+        rejected["RejectReasons"] = pd.Series(codes).map(labels).to_numpy()
+    counts = {name: int(((reasons & bit) > 0).sum()) for name, bit in REJECT_REASONS.items()}
+    return RowValidation(
+        clean=clean,
+        rejected=rejected,
+        reasons=reasons,
+        counts={k: v for k, v in counts.items() if v},
+    )
+
+
 def _normalize_pair_tuple(a: str, b: str) -> Tuple[str, str]:
     return (a.upper().strip(), b.upper().strip())
 
 
+def _known_pair_in_filename(filename: str, known: set) -> Optional[Tuple[str, str]]:
+    """First pair of known currency codes in a file name (e.g. hedges_audusd.csv -> AUD/USD), or None."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    for m in _FILENAME_PAIR_SCAN.finditer(stem):
+        pair = (m.group(1).upper(), m.group(2).upper())
+        if set(pair) <= known:
+            return pair
+    return None
+
+
+@lru_cache(maxsize=4096)
 def _parse_pair_string(s: str) -> Optional[Tuple[str, str]]:
     """Parse strings like NZDUSD, NZD_USD, NZD-USD, NZD/USD, 'NZD USD'."""
     s = s.strip()
@@ -61,6 +219,32 @@ def _parse_pair_string(s: str) -> Optional[Tuple[str, str]]:
     return None
 
 
+def parse_row_pairs(df: pd.DataFrame) -> pd.Series:
+    """
+    Per-row pair keys like 'NZD/USD' (None where unparseable), from Base/Quote columns
+    or a Pair-like column. Each distinct value is parsed once and broadcast back.
+    """
+    if "Base" in df.columns and "Quote" in df.columns:
+        raw = df["Base"].astype(str).str.strip() + "/" + df["Quote"].astype(str).str.strip()
+        raw = raw.where(df["Base"].notna() & df["Quote"].notna())
+    else:
+        col = next((c for c in df.columns if c.lower() in ("pair", "currency_pair", "pair_name")), None)
+        if col is None:
+            return pd.Series(None, index=df.index, dtype=object)
+        raw = df[col]
+
+    lookup = {}
+    for value in raw.dropna().unique():
+        parsed = _parse_pair_string(str(value).strip())
+        lookup[value] = f"{parsed[0]}/{parsed[1]}" if parsed else None
+    return raw.map(lookup).astype(object)
+
+
+def unique_pairs(pair_keys: pd.Series) -> List[Tuple[str, str]]:
+    """Distinct (BASE, QUOTE) tuples from parse_row_pairs output, in first-seen order."""
+    return [tuple(k.split("/")) for k in pair_keys.dropna().unique()]
+
+
 def infer_pair_from_df_or_filename(df: pd.DataFrame, filename: Optional[str] = None) -> Tuple[str, str]:
     """
     Attempt to infer currency pair in priority: